@@ -47,6 +47,7 @@ class Settings(BaseSettings):
     MAX_CRAWL_PAGES: int = int(os.getenv("MAX_CRAWL_PAGES", "20"))
     CRAWL_DEPTH: int = int(os.getenv("CRAWL_DEPTH", "2"))
     CRAWL_TIMEOUT: int = int(os.getenv("CRAWL_TIMEOUT", "30"))
+    MAX_CONCURRENT_CRAWLS: int = int(os.getenv("MAX_CONCURRENT_CRAWLS", "5"))
     CRAWL_USER_AGENT: str = "Mozilla/5.0 (compatible; PhonePriceComparisonBot/1.0; +https://phonepricecomparison.vn)"
     
     # Search Settings
@@ -6,14 +6,14 @@ from datetime import datetime
 from loguru import logger
 
 from app.models.chat import ChatRequest, ChatResponse, ChatSession, ChatMessage, MessageRole, MessageType
-from app.services.chat_service import ChatService
-from app.services.reflection_service import ReflectionService
-from app.services.rag_service import RAGService
+from app.services.chat_service import get_chat_service
+from app.services.reflection_service import get_reflection_service
+from app.services.rag_service import get_rag_service
 
 router = APIRouter()
-chat_service = ChatService()
-reflection_service = ReflectionService()
-rag_service = RAGService()
+chat_service = get_chat_service()
+reflection_service = get_reflection_service()
+rag_service = get_rag_service()
 
 chat_sessions: Dict[str, ChatSession] = {}
 
@@ -1,12 +1,14 @@
+import asyncio
+
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
 from app.models.product import Product, ProductListRequest, ProductComparisonRequest
-from app.services.rag_service import RAGService
-from app.services.reflection_service import ReflectionService
+from app.services.rag_service import get_rag_service
+from app.services.reflection_service import get_reflection_service
 
 router = APIRouter()
-rag_service = RAGService()
-reflection_service = ReflectionService()
+rag_service = get_rag_service()
+reflection_service = get_reflection_service()
 
 @router.get("/", response_model=List[Product])
 async def list_products(
@@ -31,9 +33,21 @@ async def list_products(
         limit=limit
     )
     
-    reflection_result = await reflection_service.reflect_on_product_list(request)
-    
+    # Tính embedding song song với reflection: nếu quyết định là
+    # rag_query thì embedding đã sẵn, nếu crawl thì bỏ đi
+    embed_task = asyncio.create_task(rag_service.embed_query(request.query))
+    try:
+        reflection_result = await reflection_service.reflect_on_product_list(request)
+    except Exception:
+        embed_task.cancel()
+        raise
+
     if reflection_result.action == "rag_query":
+        try:
+            query_embedding = await embed_task
+        except Exception:
+            # Encode lỗi thì để get_products tự encode lại trong try của nó
+            query_embedding = None
         products = await rag_service.get_products(
             query=request.query,
             price_min=request.price_min,
@@ -41,11 +55,14 @@ async def list_products(
             brands=request.brands,
             sort_by=request.sort_by,
             page=request.page,
-            limit=request.limit
+            limit=request.limit,
+            query_embedding=query_embedding
         )
     elif reflection_result.action == "crawl":
+        embed_task.cancel()
         products = await reflection_service.crawl_new_products(request)
     else:
+        embed_task.cancel()
         raise HTTPException(status_code=404, detail="Không tìm thấy sản phẩm phù hợp")
     
     return products
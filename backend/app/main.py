@@ -1,12 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.controllers import product_controller, chat_controller
 from app.config import settings
 
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    description="API cho hệ thống so sánh giá điện thoại ở Việt Nam"
+    description="API cho hệ thống so sánh giá điện thoại ở Việt Nam",
+    default_response_class=ORJSONResponse
 )
 
 # Cấu hình CORS
@@ -21,6 +23,12 @@ app.add_middleware(
 app.include_router(product_controller.router, prefix="/api/products", tags=["products"])
 app.include_router(chat_controller.router, prefix="/api/chat", tags=["chat"])
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Đóng các HTTP client dùng chung khi ứng dụng dừng."""
+    from app.services.reflection_service import get_reflection_service
+    await get_reflection_service().aclose()
+
 @app.get("/")
 async def root():
     """Route mặc định để kiểm tra API hoạt động."""
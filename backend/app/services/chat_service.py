@@ -1,3 +1,4 @@
+import functools
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
@@ -222,11 +223,10 @@ class ChatService:
         """
         Format lịch sử chat thành văn bản dễ đọc.
         """
-        formatted = []
-        for msg in history:
-            role = "Người dùng" if msg.role == "user" else "Trợ lý"
-            formatted.append(f"{role}: {msg.content}")
-        return "\n".join(formatted)
+        return "\n".join(
+            f"{'Người dùng' if msg.role == 'user' else 'Trợ lý'}: {msg.content}"
+            for msg in history
+        )
     
     def _format_products_info(self, products: List[Dict[str, Any]]) -> str:
         """
@@ -274,4 +274,12 @@ class ChatService:
             parts.append(price_str[-3:])
             price_str = price_str[:-3]
             
-        return ".".join(reversed(parts))
\ No newline at end of file
+        return ".".join(reversed(parts))
+
+
+@functools.lru_cache(maxsize=1)
+def get_chat_service() -> "ChatService":
+    """
+    Trả về instance ChatService dùng chung cho cả tiến trình.
+    """
+    return ChatService()
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import uuid
 import json
 from typing import List, Dict, Any, Optional, Union
@@ -174,6 +175,13 @@ class RAGService:
             logger.error("Error adding HTML to RAG: {}", e)
             raise
     
+    async def embed_query(self, query: str) -> List[float]:
+        """
+        Tạo embedding cho query; tách riêng để caller có thể chạy song
+        song với bước reflection.
+        """
+        return self.embedding_model.encode(query).tolist()
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     async def get_products(
         self, 
@@ -183,15 +191,18 @@ class RAGService:
         brands: Optional[List[str]] = None,
         sort_by: str = "relevance",
         page: int = 1,
-        limit: int = 10
+        limit: int = 10,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Product]:
         """
         Tìm kiếm sản phẩm từ vector database dựa vào query và filters.
+        Nhận query_embedding đã tính sẵn nếu có để khỏi encode lại.
         """
         logger.info("Searching products with query: {}", query)
         
         try:
-            query_embedding = self.embedding_model.encode(query).tolist()
+            if query_embedding is None:
+                query_embedding = await self.embed_query(query)
             
             filter_conditions = []
             
@@ -489,4 +500,13 @@ class RAGService:
             return collection_info.vectors_count
         except Exception as e:
             logger.error("Error getting product count from RAG: {}", e)
-            return 0
\ No newline at end of file
+            return 0
+
+
+@functools.lru_cache(maxsize=1)
+def get_rag_service() -> "RAGService":
+    """
+    Trả về instance RAGService dùng chung: model embedding chỉ nên nạp
+    một lần cho cả tiến trình.
+    """
+    return RAGService()
@@ -1,78 +1,145 @@
+import functools
+import heapq
+import types
+import itertools
+import operator
+import sys
 import httpx
-import json
+import orjson
+import random
 import re
-import uuid
 import asyncio
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from bs4 import BeautifulSoup
+from urllib.parse import quote_plus
 import google.generativeai as genai
+import numpy as np
+from cachetools import TTLCache
+import soupsieve as sv
 from tenacity import retry, stop_after_attempt, wait_exponential
 from loguru import logger
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
 from app.config import settings
-from app.models.chat import ChatMessage, ReflectionResult
+from app.models.chat import ChatMessage, MessageRole, ReflectionResult
 from app.models.product import Product, ProductListRequest, ProductSource, ProductSpecification
+from langchain_core.documents import Document
 from app.utils.helpers import (
-    extract_domain, clean_text, extract_price, 
-    normalize_brand_name
+    BS_PARSER, build_absolute_url, classify_spec_key, extract_domain, clean_text, extract_price, generate_product_id,
+    normalize_brand_name, strip_html_to_text, strip_page_chrome_to_text
 )
-from pydantic import  ValidationError
+from pydantic import TypeAdapter, ValidationError
 
 
-class ReflectionService:
+# Các trường thông số có giá trị dạng danh sách
+_LIST_SPEC_FIELDS = frozenset({'connectivity', 'color'})
+
+# Khung specifications rỗng dùng chung; _new_specs_dict() copy nông rồi
+# thay các giá trị mutable, rẻ hơn dựng lại dict literal 12 khóa mỗi sản phẩm
+_SPECS_TEMPLATE = {
+    "cpu": None,
+    "ram": None,
+    "storage": None,
+    "display": None,
+    "camera": None,
+    "battery": None,
+    "os": None,
+    "connectivity": None,
+    "color": None,
+    "dimensions": None,
+    "weight": None,
+    "additional_specs": None,
+}
+
+
+def _new_specs_dict() -> Dict[str, Any]:
     """
-    Service xử lý reflection để quyết định nên truy vấn RAG hay crawl dữ liệu mới.
+    Tạo dict thông số rỗng từ khung chia sẻ (các khóa được dùng lại,
+    container mutable tạo mới cho từng sản phẩm).
     """
-    
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(settings.GEMINI_MODEL, 
-                                         generation_config={
-                                             "temperature": settings.LLM_TEMPERATURE,
-                                             "max_output_tokens": settings.LLM_MAX_TOKENS,
-                                         })
-        
-        self.client = httpx.AsyncClient(timeout=settings.CRAWL_TIMEOUT)
-        
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        
-        logger.info("ReflectionService initialized with model: {}", settings.GEMINI_MODEL)
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    async def reflect_on_chat_message(
-        self, 
-        message: str, 
-        chat_history: List[ChatMessage]
-    ) -> ReflectionResult:
-        """
-        Phân tích tin nhắn chat để xác định hành động tiếp theo.
-        """
-        logger.info("Reflecting on chat message: {}", message[:50] + "..." if len(message) > 50 else message)
-        
-        prompt = f"""
-        Hãy phân tích tin nhắn này từ người dùng và lịch sử chat để xác định hành động tiếp theo.
-        
-        Tin nhắn: {message}
-        
-        Lịch sử chat (3 tin nhắn gần nhất):
-        {self._format_chat_history(chat_history[-6:] if len(chat_history) > 6 else chat_history)}
-        
+    specs = _SPECS_TEMPLATE.copy()
+    specs["connectivity"] = []
+    specs["color"] = []
+    specs["additional_specs"] = {}
+    return specs
+
+# Regex làm sạch chuỗi giá từ LLM (giữ chữ số và dấu chấm)
+_PRICE_CLEAN_RE = re.compile(r'[^\d.]')
+
+# Regex nhận diện thương hiệu, biên dịch một lần ở mức module
+_BRAND_RE = re.compile(
+    r'^(Samsung|Apple|iPhone|Xiaomi|Oppo|Vivo|Nokia|Realme|Huawei|Honor)',
+    re.IGNORECASE
+)
+
+
+_MSG_ROLE_CONTENT = operator.attrgetter("role", "content")
+# Key sort theo giá, gọi ở tầng C thay vì lambda Python per-element;
+# các extractor luôn điền min_price nên truy cập trực tiếp an toàn
+_KEY_MIN_PRICE = operator.itemgetter("min_price")
+_ASSISTANT_LABEL = "Trợ lý"
+_ROLE_LABELS = {
+    "user": "Người dùng",
+    MessageRole.USER: "Người dùng",
+}
+
+
+def _parse_llm_json(text: str) -> Optional[Any]:
+    """
+    Parse JSON từ phản hồi LLM: thử orjson trực tiếp trước (model JSON
+    mode thường trả JSON thuần), chỉ khi thất bại mới tách fence rồi
+    regex - tránh quét DOTALL trên phản hồi dài ở đường đi thường gặp.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+
+    fenced = _extract_json_fence(text)
+    if fenced is not None:
+        try:
+            return orjson.loads(fenced)
+        except orjson.JSONDecodeError:
+            pass
+
+    match = _JSON_ARRAY_RE.search(text) or _JSON_OBJECT_RE.search(text)
+    if match:
+        try:
+            return orjson.loads(match.group(0))
+        except orjson.JSONDecodeError:
+            pass
+
+    return None
+
+
+def _extract_json_fence(text: str) -> Optional[str]:
+    """
+    Tách khối ```json ... ``` từ phản hồi LLM bằng hai lần str.find,
+    tránh regex DOTALL backtracking trên văn bản dài.
+    """
+    start = text.find('```json')
+    if start == -1:
+        return None
+    start += len('```json')
+    end = text.find('```', start)
+    if end == -1:
+        return None
+    return text[start:end].strip()
+
+# Các prompt reflection được dựng sẵn ở mức module: phần hướng dẫn tĩnh đặt
+# trước, dữ liệu động đặt cuối để provider có thể cache phần prefix chung
+_CHAT_REFLECTION_PROMPT = """
+        Hãy phân tích tin nhắn từ người dùng và lịch sử chat để xác định hành động tiếp theo.
+
         Hãy phân loại tin nhắn này vào một trong các hành động sau:
         1. product_list: Người dùng đang tìm kiếm danh sách sản phẩm
         2. product_detail: Người dùng đang yêu cầu thông tin chi tiết về một sản phẩm cụ thể
         3. product_comparison: Người dùng muốn so sánh các sản phẩm
         4. answer: Trả lời câu hỏi thông thường
-        
+
         Trả về kết quả dưới dạng JSON theo định dạng sau:
         ```json
         {{
-            "action": "action_name", 
-            "query": "truy vấn tìm kiếm", 
+            "action": "action_name",
+            "query": "truy vấn tìm kiếm",
             "confidence": 0.9,
             "additional_info": {{
                 "key1": "value1",
@@ -80,39 +147,561 @@ class ReflectionService:
             }}
         }}
         ```
-        
+
         Đối với product_list, additional_info nên bao gồm:
         - price_min (nếu có): giá tối thiểu
         - price_max (nếu có): giá tối đa
         - brands (nếu có): danh sách thương hiệu
-        
+
         Đối với product_detail, additional_info nên bao gồm:
         - product_id (nếu có): ID sản phẩm
         - product_name (nếu có): tên sản phẩm
-        
+
         Đối với product_comparison, additional_info nên bao gồm:
         - product_ids (nếu có): danh sách ID sản phẩm
         - product_names (nếu có): danh sách tên sản phẩm
+
+        Tin nhắn: {message}
+
+        Lịch sử chat (3 tin nhắn gần nhất):
+        {history}
+        """
+
+_PRODUCT_LIST_REFLECTION_PROMPT = """
+        Xác định xem nên truy vấn dữ liệu từ cơ sở dữ liệu RAG hiện có hay nên crawl dữ liệu mới.
+
+        Hãy quyết định:
+        1. "rag_query": Sử dụng dữ liệu từ cơ sở dữ liệu RAG hiện có
+        2. "crawl": Crawl dữ liệu mới từ web
+
+        Trả về kết quả JSON với decision, explanation và confidence.
+        ```json
+        {{
+            "decision": "rag_query",
+            "explanation": "Lý do quyết định",
+            "confidence": 0.8
+        }}
+        ```
+
+        Yêu cầu tìm kiếm:
+        - Query: {query}
+        - Giá tối thiểu: {price_min}
+        - Giá tối đa: {price_max}
+        - Thương hiệu: {brands}
+        - Sắp xếp theo: {sort_by}
         """
+
+# Bảng selector theo domain, dựng sẵn một lần ở mức module để không phải
+# cấp phát lại dict trên mỗi lần gọi
+_DEFAULT_LIST_SELECTORS = types.MappingProxyType({
+    "product_item": "div.product-item, div.product-card, div.product, .cate-pro-item, li.item",
+    "product_name": "h3.product-name, h2.product-title, div.product-info h3, .cate-pro-name, h3",
+    "product_price": "span.price, div.product-price, p.price, .cate-pro-price, .price",
+    "product_image": "img.product-image, div.product-img img, .cate-pro-img img, img",
+    "product_link": "a.product-link, div.product-img a, h3.product-name a, a.pro-thumb, a"
+})
+
+_LIST_SELECTORS_BY_DOMAIN = types.MappingProxyType({
+    "thegioididong.com": {
+        "product_item": "li.item",
+        "product_name": "h3",
+        "product_price": "strong.price",
+        "product_image": "img.thumb",
+        "product_link": "a"
+    },
+    "fptshop.com.vn": {
+        "product_item": "div.cdt-product",
+        "product_name": "h3",
+        "product_price": "div.progress",
+        "product_image": "img",
+        "product_link": "a"
+    },
+    "cellphones.com.vn": {
+        "product_item": "div.product-item",
+        "product_name": "h3.product-name",
+        "product_price": "p.special-price",
+        "product_image": "img.product-img",
+        "product_link": "a.product-name"
+    }
+})
+
+_DEFAULT_DETAIL_SELECTORS = types.MappingProxyType({
+    "product_name": "h1.product-name, h1.product-title, div.product-title h1, h1[itemprop='name']",
+    "product_price": "span.price, div.product-price, p.special-price, span[itemprop='price']",
+    "product_images": "div.product-gallery img, img.product-image, div.carousel img, div.swiper-slide img",
+    "product_description": "div.product-description, div.product-content, div.description-content, div[itemprop='description']",
+    "product_specifications": "table.specifications, div.specifications-content, ul.specifications, div.st-param",
+    "product_brand": "span.brand, div.brand, a.brand, meta[itemprop='brand']"
+})
+
+_DETAIL_SELECTORS_BY_DOMAIN = types.MappingProxyType({
+    "thegioididong.com": {
+        "product_name": "h1",
+        "product_price": "div.box-price p",
+        "product_images": "div.owl-carousel img",
+        "product_description": "div.article-content",
+        "product_specifications": "div.parameter",
+        "product_brand": "meta[itemprop='brand']"
+    },
+    "fptshop.com.vn": {
+        "product_name": "h1.st-name",
+        "product_price": "div.st-price",
+        "product_images": "div.st-slider img",
+        "product_description": "div.st-specification",
+        "product_specifications": "div.st-param",
+        "product_brand": "h1.st-name"
+    },
+    "cellphones.com.vn": {
+        "product_name": "h1.product-name",
+        "product_price": "p.product-price--current",
+        "product_images": "div.product-image img",
+        "product_description": "div.product-description",
+        "product_specifications": "div.product-technical-content",
+        "product_brand": "div.product-brand"
+    }
+})
+
+_SOURCE_NAME_BY_DOMAIN = types.MappingProxyType({
+    "thegioididong.com": "Thế Giới Di Động",
+    "fptshop.com.vn": "FPT Shop",
+    "cellphones.com.vn": "CellphoneS",
+    "tiki.vn": "Tiki",
+    "lazada.vn": "Lazada",
+    "shopee.vn": "Shopee",
+    "viettelstore.vn": "Viettel Store",
+    "hoanghamobile.com": "Hoàng Hà Mobile",
+    "nguyenkim.com": "Nguyễn Kim",
+    "sendo.vn": "Sendo",
+    "dienmayxanh.com": "Điện Máy Xanh"
+})
+
+
+def _compile_selector_map(mapping: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Biên dịch trước các CSS selector bằng soupsieve để khỏi parse lại
+    chuỗi selector trên mỗi lần select().
+    """
+    return {field: sv.compile(selector) for field, selector in mapping.items()}
+
+
+_COMPILED_LIST_DEFAULT = _compile_selector_map(_DEFAULT_LIST_SELECTORS)
+_COMPILED_LIST_BY_DOMAIN = {
+    domain: _compile_selector_map(mapping)
+    for domain, mapping in _LIST_SELECTORS_BY_DOMAIN.items()
+}
+_COMPILED_DETAIL_DEFAULT = _compile_selector_map(_DEFAULT_DETAIL_SELECTORS)
+_COMPILED_DETAIL_BY_DOMAIN = {
+    domain: _compile_selector_map(mapping)
+    for domain, mapping in _DETAIL_SELECTORS_BY_DOMAIN.items()
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _source_name_for_domain(domain: str) -> str:
+    """
+    Phân giải tên nguồn hiển thị từ domain, có cache vì số domain ít
+    mà số lần tra cứu trong một lượt crawl lại rất nhiều.
+    """
+    name = _lookup_by_domain(domain, _SOURCE_NAME_BY_DOMAIN)
+    if name is not None:
+        return name
+
+    return domain.split('.')[0].capitalize()
+
+
+def _match_fields_single_pass(soup, compiled_map: Dict[str, Any], list_fields: frozenset) -> Dict[str, Any]:
+    """
+    Duyệt cây DOM đúng một lần và so khớp từng phần tử với tất cả
+    selector đã biên dịch, thay vì mỗi selector quét lại toàn bộ cây.
+    Trường trong list_fields gom mọi phần tử khớp, còn lại lấy phần tử đầu.
+    """
+    results: Dict[str, Any] = {
+        field: [] if field in list_fields else None
+        for field in compiled_map
+    }
+    pending = set(compiled_map)
+
+    for element in soup.descendants:
+        if element.name is None:
+            continue
+        for field in tuple(pending):
+            if compiled_map[field].match(element):
+                if field in list_fields:
+                    results[field].append(element)
+                else:
+                    results[field] = element
+                    pending.discard(field)
+        if not pending:
+            break
+
+    return results
+
+
+def _strip_brand_prefix(name: str, brand: str) -> str:
+    """
+    Bỏ thương hiệu khỏi tên sản phẩm để lấy model; removeprefix rẻ hơn
+    replace vì không quét toàn chuỗi khi brand nằm ngay đầu tên.
+    """
+    if brand and name.startswith(brand):
+        return name.removeprefix(brand).strip()
+    return name.replace(brand, '', 1).strip()
+
+
+# Các domain thương mại điện tử Việt Nam hợp lệ; tuple để str.endswith
+# kiểm tra tất cả trong một lần gọi C
+_VALID_ECOMMERCE_DOMAINS = (
+    "thegioididong.com", "fptshop.com.vn", "cellphones.com.vn",
+    "tiki.vn", "lazada.vn", "shopee.vn", "viettelstore.vn",
+    "hoanghamobile.com", "nguyenkim.com", "sendo.vn",
+    "dienmayxanh.com", "bachlong.vn", "hangchinhhieu.vn",
+    "vienthongA.vn", "phongvu.vn", "anphatpc.com.vn",
+    "hacom.vn", "didongviet.vn", "hnam.com.vn"
+)
+
+def _build_crawl4ai_schema(selectors: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Chuyển bảng selector danh sách thành schema trích xuất CSS của
+    crawl4ai để server trích sẵn, đỡ parse HTML phía Python.
+    """
+    return {
+        "name": "products",
+        "baseSelector": selectors["product_item"],
+        "fields": [
+            {"name": "name", "selector": selectors["product_name"], "type": "text"},
+            {"name": "price", "selector": selectors["product_price"], "type": "text"},
+            {"name": "image", "selector": selectors["product_image"], "type": "attribute", "attribute": "src"},
+            {"name": "link", "selector": selectors["product_link"], "type": "attribute", "attribute": "href"},
+        ],
+    }
+
+
+# Trang danh sách lớn hơn ngưỡng này (bytes ký tự) thì parse tăng dần
+# bằng lxml thay vì dựng toàn bộ cây DOM
+_LARGE_HTML_THRESHOLD = 500_000
+_MAX_PULLED_ITEMS = 60
+
+
+def _parse_simple_item_selectors(selector_str: str) -> List[tuple]:
+    """
+    Tách selector product_item dạng 'tag.class, .class, tag' thành các
+    cặp (tag, class) đơn giản cho bộ so khớp SAX; selector phức tạp hơn
+    bị bỏ qua (caller sẽ fallback về parse đầy đủ).
+    """
+    pairs = []
+    for part in selector_str.split(','):
+        part = part.strip()
+        if not part or ' ' in part or '>' in part or '[' in part:
+            continue
+        if '.' in part:
+            tag, _, cls = part.partition('.')
+            pairs.append((tag or None, cls))
+        else:
+            pairs.append((part, None))
+    return pairs
+
+
+def _collect_product_cards(html_content: str, item_selector: str, max_items: int = _MAX_PULLED_ITEMS) -> Optional[str]:
+    """
+    Quét HTML lớn theo kiểu SAX bằng lxml HTMLPullParser: nạp từng khối
+    64KB, nhặt các thẻ khớp selector product_item rồi dừng sớm khi đủ
+    max_items. Trả về HTML gộp của các card, hoặc None nếu không khớp.
+    """
+    matchers = _parse_simple_item_selectors(item_selector)
+    if not matchers:
+        return None
+
+    try:
+        from lxml import etree
+    except ImportError:
+        return None
+
+    parser = etree.HTMLPullParser(events=('end',))
+    cards = []
+
+    try:
+        for start in range(0, len(html_content), 65536):
+            parser.feed(html_content[start:start + 65536])
+
+            for _, element in parser.read_events():
+                tag = element.tag
+                classes = element.get('class', '')
+                for m_tag, m_cls in matchers:
+                    if m_tag is not None and tag != m_tag:
+                        continue
+                    if m_cls is not None and m_cls not in classes.split():
+                        continue
+                    cards.append(etree.tostring(element, encoding='unicode'))
+                    element.clear()
+                    break
+
+                if len(cards) >= max_items:
+                    return ''.join(cards)
+    except Exception as e:
+        logger.error("Error during incremental HTML parse: {}", e)
+        return None
+
+    return ''.join(cards) if cards else None
+
+
+# Gom nhiều trang cần trích xuất bằng LLM vào một lời gọi Gemini:
+# N round-trip ~1-3s/trang trở thành N/_LLM_BATCH_SIZE lời gọi
+_LLM_BATCH_SIZE = 4
+_LLM_BATCH_TEXT_CAP = 6000
+
+_DETAIL_LIST_FIELDS = frozenset({"product_images"})
+
+# Regex tách JSON từ phản hồi LLM, biên dịch một lần ở mức module
+_JSON_ARRAY_RE = re.compile(r'\[\s*\{.*\}\s*\]', re.DOTALL)
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Cache kết quả parse danh sách sản phẩm theo (url, hash nội dung) để các
+# truy vấn gần nhau không parse lại cùng một trang HTML
+_EXTRACT_CACHE: TTLCache = TTLCache(maxsize=64, ttl=settings.CACHE_TTL)
+
+# Cache kết quả reflection: câu hỏi/bộ lọc trùng nhau không cần gọi lại
+# Gemini (khớp chính xác theo nội dung, TTL ngắn hơn cache crawl)
+_REFLECTION_CACHE: TTLCache = TTLCache(maxsize=256, ttl=settings.CACHE_TTL)
+
+# URL đã crawl gần đây -> list sản phẩm đã trích xuất; truy vấn lặp lại
+# trong TTL không phải fetch, parse hay embed lại trang đó
+_CRAWLED_URL_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=settings.CACHE_TTL)
+
+# Kết quả SearXNG cho cùng một truy vấn thay đổi theo giờ; cache 10 phút
+# để các phiên hỏi cùng "iphone 15"... không đập vào SearXNG liên tục.
+# Truy vấn rỗng/lỗi được negative-cache ngắn hơn để khỏi retry dồn dập.
+_SEARCH_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=600)
+_SEARCH_EMPTY_CACHE: TTLCache = TTLCache(maxsize=256, ttl=120)
+
+# User-agent và headers cho crawl, dựng sẵn một lần ở mức module thay vì
+# tạo lại dict mỗi lần crawl (trước đây nhánh fallback httpx còn tham
+# chiếu biến cục bộ của nhánh crawl4ai, lỗi nếu nhánh đó ném sớm)
+_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.0 Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:113.0) Gecko/20100101 Firefox/113.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36"
+)
+
+_CRAWL_HEADERS = types.MappingProxyType({
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Cache-Control": "max-age=0",
+    "Connection": "keep-alive",
+    "Sec-Ch-Ua": '"Chromium";v="125", "Google Chrome";v="125"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Ch-Ua-Platform": '"Windows"',
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Upgrade-Insecure-Requests": "1"
+})
+
+_FALLBACK_HEADERS = types.MappingProxyType({
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Cache-Control": "max-age=0",
+    "Referer": "https://www.google.com/",
+    "Sec-Ch-Ua": '"Chromium";v="125", "Google Chrome";v="125"',
+    "Sec-Ch-Ua-Mobile": "?0",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "cross-site",
+    "Upgrade-Insecure-Requests": "1",
+    "Connection": "keep-alive"
+})
+
+# Phần tĩnh của payload crawl4ai; mỗi lời gọi chỉ bổ sung urls/user_agent/extract
+_CRAWL4AI_BASE_PAYLOAD = types.MappingProxyType({
+    "depth": 0,
+    "respect_robots_txt": False,
+    "headers": dict(_CRAWL_HEADERS),
+    "extract_html": True,
+    "timeout": 30,
+    "retry": 3
+})
+
+# Từ khóa nhận diện thương hiệu trong truy vấn cho URL dự phòng, dựng một
+# lần ở mức module
+_FALLBACK_BRAND_KEYWORDS = types.MappingProxyType({
+    "xiaomi": ("xiaomi", "redmi", "poco"),
+    "samsung": ("samsung", "galaxy"),
+    "apple": ("apple", "iphone"),
+    "oppo": ("oppo",),
+    "vivo": ("vivo",),
+    "realme": ("realme",),
+    "nokia": ("nokia",),
+    "huawei": ("huawei",),
+    "honor": ("honor",)
+})
+
+# URL dự phòng dựng sẵn: template tìm kiếm, danh mục chung và danh mục
+# theo từng thương hiệu trong bảng từ khóa ở trên
+_FALLBACK_SEARCH_URL_TMPLS = (
+    "https://www.thegioididong.com/tim-kiem?q={q}",
+    "https://fptshop.com.vn/tim-kiem/{q}",
+    "https://cellphones.com.vn/catalogsearch/result/?q={q}",
+    "https://hoanghamobile.com/tim-kiem?kwd={q}"
+)
+
+_FALLBACK_CATEGORY_URLS = (
+    "https://www.thegioididong.com/dtdd",
+    "https://fptshop.com.vn/dien-thoai",
+    "https://cellphones.com.vn/mobile.html",
+    "https://hoanghamobile.com/dien-thoai-di-dong"
+)
+
+_FALLBACK_BRAND_URLS = types.MappingProxyType({
+    brand: (
+        f"https://www.thegioididong.com/dtdd-{brand}",
+        f"https://fptshop.com.vn/dien-thoai/{brand}",
+        f"https://cellphones.com.vn/mobile/{brand}.html",
+        f"https://hoanghamobile.com/dien-thoai-di-dong/{brand}"
+    )
+    for brand in _FALLBACK_BRAND_KEYWORDS
+})
+
+
+def _lookup_by_domain(domain: str, mapping: Dict[str, Any]) -> Optional[Any]:
+    """
+    Tra cứu theo domain đăng ký: thử nguyên domain rồi cắt dần nhãn bên
+    trái ('m.fptshop.com.vn' -> 'fptshop.com.vn'), mỗi bước một phép dò
+    dict O(1) thay vì quét endswith tuyến tính qua cả bảng.
+    """
+    hit = mapping.get(domain)
+    if hit is not None:
+        return hit
+
+    parts = domain.split('.')
+    for i in range(1, len(parts) - 1):
+        hit = mapping.get('.'.join(parts[i:]))
+        if hit is not None:
+            return hit
+    return None
+
+
+# Validator biên dịch sẵn của pydantic-core: validate dict mà không phải
+# cấp phát instance Product mỗi lần
+_PRODUCT_ADAPTER = TypeAdapter(Product)
+
+
+def _is_acceptable_product(product_dict: Dict[str, Any]) -> bool:
+    """
+    Kiểm tra sản phẩm crawl được qua validator biên dịch sẵn: sản phẩm
+    lỗi bị loại tại đây thay vì làm hỏng cả response ở biên API.
+    """
+    if not product_dict.get("name") or not product_dict.get("sources"):
+        return False
+
+    try:
+        _PRODUCT_ADAPTER.validate_python(product_dict)
+        return True
+    except ValidationError as ve:
+        logger.error("Validation error for product data: {}", ve)
+        return False
+
+
+class ReflectionService:
+    """
+    Service xử lý reflection để quyết định nên truy vấn RAG hay crawl dữ liệu mới.
+    """
+    
+    def __init__(self):
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self.model = genai.GenerativeModel(settings.GEMINI_MODEL, 
+                                         generation_config={
+                                             "temperature": settings.LLM_TEMPERATURE,
+                                             "max_output_tokens": settings.LLM_MAX_TOKENS,
+                                         })
+        # Model riêng ép đầu ra application/json: phản hồi là JSON thuần,
+        # không tốn token cho rào ```json và không cần regex tách nữa
+        self.json_model = genai.GenerativeModel(settings.GEMINI_MODEL,
+                                         generation_config={
+                                             "temperature": settings.LLM_TEMPERATURE,
+                                             "max_output_tokens": settings.LLM_MAX_TOKENS,
+                                             "response_mime_type": "application/json",
+                                         })
         
+        self.client = httpx.AsyncClient(
+            timeout=settings.CRAWL_TIMEOUT,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=settings.MAX_CONCURRENT_CRAWLS * 2,
+                max_keepalive_connections=settings.MAX_CONCURRENT_CRAWLS,
+                keepalive_expiry=30.0
+            )
+        )
+
+        # Single-flight cho tìm kiếm: truy vấn trùng nhau đang chạy chia
+        # sẻ chung một task thay vì gọi SearXNG song song
+        self._search_inflight: Dict[str, asyncio.Task] = {}
+        self._crawl_inflight: Dict[tuple, asyncio.Task] = {}
+
+        logger.info("ReflectionService initialized with model: {}", settings.GEMINI_MODEL)
+
+    async def aclose(self):
+        """
+        Đóng HTTP client khi ứng dụng shutdown để trả lại kết nối.
+        """
+        await self.client.aclose()
+
+    @functools.cached_property
+    def text_splitter(self):
+        """
+        Khởi tạo text splitter khi dùng lần đầu để không kéo langchain
+        vào thời điểm import module.
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        return RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200
+        )
+    
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    async def reflect_on_chat_message(
+        self, 
+        message: str, 
+        chat_history: List[ChatMessage]
+    ) -> ReflectionResult:
+        """
+        Phân tích tin nhắn chat để xác định hành động tiếp theo.
+        """
+        logger.info("Reflecting on chat message: {}", message[:50] + "..." if len(message) > 50 else message)
+
+        cache_key = ("chat", message, tuple(
+            (msg.role, msg.content) for msg in chat_history[-6:]
+        ))
+        if settings.ENABLE_CACHE:
+            cached = _REFLECTION_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info("Using cached reflection for chat message")
+                return cached.model_copy()
+
+        history = chat_history[-6:] if len(chat_history) > 6 else chat_history
+        prompt = _CHAT_REFLECTION_PROMPT.format(
+            message=message,
+            history=self._format_chat_history(history) if history else ""
+        )
+
         try:
-            response = await self.model.generate_content_async(prompt)
+            response = await self.json_model.generate_content_async(prompt)
             
-            json_match = re.search(r'```json\s+(.*?)\s+```', response.text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = response.text
-                
+            json_str = _extract_json_fence(response.text) or response.text
+
+
             try:
-                result = json.loads(json_str)
-                return ReflectionResult(
+                result = orjson.loads(json_str)
+                reflection = ReflectionResult(
                     action=result.get("action", "answer"),
                     query=result.get("query", message),
                     confidence=result.get("confidence", 0.0),
                     additional_info=result.get("additional_info", {})
                 )
-            except json.JSONDecodeError as e:
+                if settings.ENABLE_CACHE:
+                    _REFLECTION_CACHE[cache_key] = reflection
+                return reflection
+            except orjson.JSONDecodeError as e:
                 logger.error("Error decoding JSON from Gemini response: {}", e)
                 return ReflectionResult(
                     action="answer",
@@ -133,40 +722,30 @@ class ReflectionService:
         Quyết định nên lấy dữ liệu sản phẩm từ RAG hay crawl mới.
         """
         logger.info("Reflecting on product list request: {}", request.query)
-        
-        prompt = f"""
-        Xác định xem nên truy vấn dữ liệu từ cơ sở dữ liệu RAG hiện có hay nên crawl dữ liệu mới.
-        
-        Yêu cầu tìm kiếm:
-        - Query: {request.query}
-        - Giá tối thiểu: {request.price_min if request.price_min else "Không có"}
-        - Giá tối đa: {request.price_max if request.price_max else "Không có"}
-        - Thương hiệu: {", ".join(request.brands) if request.brands else "Không có"}
-        - Sắp xếp theo: {request.sort_by}
-        
-        Hãy quyết định:
-        1. "rag_query": Sử dụng dữ liệu từ cơ sở dữ liệu RAG hiện có
-        2. "crawl": Crawl dữ liệu mới từ web
-        
-        Trả về kết quả JSON với decision, explanation và confidence.
-        ```json
-        {{
-            "decision": "rag_query",
-            "explanation": "Lý do quyết định",
-            "confidence": 0.8
-        }}
-        ```
-        """
-        
+
+        cache_key = (
+            "product_list", request.query, request.price_min, request.price_max,
+            tuple(request.brands) if request.brands else None, request.sort_by
+        )
+        if settings.ENABLE_CACHE:
+            cached = _REFLECTION_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info("Using cached reflection for product list request")
+                return cached.model_copy()
+
+        prompt = _PRODUCT_LIST_REFLECTION_PROMPT.format(
+            query=request.query,
+            price_min=request.price_min if request.price_min else "Không có",
+            price_max=request.price_max if request.price_max else "Không có",
+            brands=", ".join(request.brands) if request.brands else "Không có",
+            sort_by=request.sort_by
+        )
+
         try:
-            response = await self.model.generate_content_async(prompt)
+            response = await self.json_model.generate_content_async(prompt)
             
             try:
-                json_match = re.search(r'```json\s+(.*?)\s+```', response.text, re.DOTALL)
-                if json_match:
-                    result = json.loads(json_match.group(1))
-                else:
-                    result = json.loads(response.text)
+                result = orjson.loads(_extract_json_fence(response.text) or response.text)
                 
                 action = result.get("decision", "rag_query")
                 explanation = result.get("explanation", "")
@@ -174,7 +753,7 @@ class ReflectionService:
                 
                 logger.info("Reflection decision: {} with confidence {}", action, confidence)
                 
-                return ReflectionResult(
+                reflection = ReflectionResult(
                     action=action,
                     query=request.query,
                     confidence=confidence,
@@ -185,7 +764,10 @@ class ReflectionService:
                         "brands": request.brands
                     }
                 )
-            except (json.JSONDecodeError, AttributeError) as e:
+                if settings.ENABLE_CACHE:
+                    _REFLECTION_CACHE[cache_key] = reflection
+                return reflection
+            except (orjson.JSONDecodeError, AttributeError) as e:
                 logger.error("Error processing Gemini response: {}", e)
                 return ReflectionResult(
                     action="rag_query",
@@ -241,71 +823,146 @@ class ReflectionService:
             
         logger.info("Found {} URLs from search", len(search_results))
         
-        from app.services.rag_service import RAGService
-        rag_service = RAGService()
-        
+        from app.services.rag_service import get_rag_service
+        rag_service = get_rag_service()
+
         product_jsons = []
-        
-        for url in search_results:
-            try:
-                html_content = await self._crawl_html(url)
-                
-                if not html_content:
+        all_chunks = []
+        crawl_time_iso = datetime.now().isoformat()
+        semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_CRAWLS)
+
+        def build_chunks(url: str, domain: str, text_content: str):
+            # Chia văn bản đã làm sạch thay vì HTML thô: splitter chạy trên
+            # ~30KB text thay vì ~500KB markup
+            document = Document(
+                page_content=text_content,
+                metadata={
+                    "source": url,
+                    "date": crawl_time_iso,
+                    "domain": domain,
+                    "query": request.query
+                }
+            )
+            return self.text_splitter.split_documents([document])
+
+        async def process_url(url: str):
+            if settings.ENABLE_CACHE:
+                cached = _CRAWLED_URL_CACHE.get(url)
+                if cached is not None:
+                    # Trang này đã được embed trong TTL nên không trả chunks,
+                    # tránh ghi trùng vào RAG
+                    logger.info("Skipping recently crawled URL: {}", url)
+                    return [], list(cached), None
+
+            async with semaphore:
+                domain = extract_domain(url)
+                extract_schema = None
+                if _lookup_by_domain(domain, _LIST_SELECTORS_BY_DOMAIN) is not None:
+                    extract_schema = _build_crawl4ai_schema(self._get_selectors_for_domain(domain))
+
+                html_content, extracted = await self._crawl_page(url, extract_schema)
+
+                if not html_content and not extracted:
                     logger.warning("No HTML content from URL: {}", url)
+                    return None
+
+                products_from_url = self._products_from_extracted(extracted, url, domain)
+
+                if not html_content:
+                    return [], products_from_url, None
+
+                # Làm sạch MỘT lần: văn bản này vừa nuôi prompt LLM vừa là
+                # nội dung chunk RAG, không split khi chưa chắc có sản phẩm
+                text_content = await asyncio.to_thread(strip_page_chrome_to_text, html_content)
+
+                if not products_from_url:
+                    # Để dành cho bước batch-LLM sau gather: nhiều trang được
+                    # gom vào một lời gọi Gemini thay vì mỗi trang một round-trip
+                    return None, None, text_content
+
+                chunks = build_chunks(url, domain, text_content)
+
+                if settings.ENABLE_CACHE:
+                    _CRAWLED_URL_CACHE[url] = products_from_url
+
+                return chunks, products_from_url, None
+
+        results = await asyncio.gather(
+            *(process_url(url) for url in search_results),
+            return_exceptions=True
+        )
+
+        pending_llm = []
+        for url, outcome in zip(search_results, results):
+            if isinstance(outcome, Exception):
+                logger.error("Error processing URL {}: {}", url, outcome)
+                continue
+            if outcome is None:
+                continue
+
+            chunks, products_from_url, text_pending = outcome
+            if text_pending is not None:
+                pending_llm.append((url, text_pending))
+                continue
+            if products_from_url:
+                for chunk in chunks:
+                    chunk.metadata["product_data"] = products_from_url
+
+                all_chunks.extend(chunks)
+                product_jsons.extend(products_from_url)
+
+        # Các trang không có selector/schema: gom theo lô, một lời gọi Gemini
+        # cho mỗi _LLM_BATCH_SIZE trang
+        for batch_start in range(0, len(pending_llm), _LLM_BATCH_SIZE):
+            batch = pending_llm[batch_start:batch_start + _LLM_BATCH_SIZE]
+            pages = [(url, extract_domain(url), text) for url, text in batch]
+            batch_results = await self._extract_products_batch(pages, request.query)
+
+            for (url, domain, text_content), products_from_url in zip(pages, batch_results):
+                if not products_from_url:
                     continue
-                
-                document = Document(
-                    page_content=html_content,
-                    metadata={
-                        "source": url,
-                        "date": datetime.now().isoformat(),
-                        "domain": extract_domain(url),
-                        "query": request.query
-                    }
-                )
-                
-                chunks = self.text_splitter.split_documents([document])
-                
-                products_from_url = await self._extract_products_with_llm(html_content, url, request.query)
-                
-                if products_from_url:
-                    for chunk in chunks:
-                        chunk.metadata["product_data"] = products_from_url
-                    
-                    await rag_service.add_documents_to_rag(chunks)
-                    product_jsons.extend(products_from_url)
-                
+                if settings.ENABLE_CACHE:
+                    _CRAWLED_URL_CACHE[url] = products_from_url
+
+                chunks = build_chunks(url, domain, text_content)
+                for chunk in chunks:
+                    chunk.metadata["product_data"] = products_from_url
+
+                all_chunks.extend(chunks)
+                product_jsons.extend(products_from_url)
+
+        if all_chunks:
+            try:
+                await rag_service.add_documents_to_rag(all_chunks)
             except Exception as e:
-                logger.error("Error processing URL {}: {}", url, e)
-        
-        filtered_products = self._filter_products(product_jsons, request)
-        sorted_products = self._sort_products(filtered_products, request.sort_by)
-        
+                # Qdrant lỗi thì vẫn trả sản phẩm đã crawl được, chỉ mất
+                # phần ghi vào RAG
+                logger.error("Error adding crawled documents to RAG: {}", e)
+
         limit = request.limit or 10
         page = request.page or 1
         start_idx = (page - 1) * limit
         end_idx = start_idx + limit
-        
-        logger.info("Returning {} products from {} crawled", 
-                min(len(sorted_products), limit), len(product_jsons))
-        
-        return sorted_products[start_idx:end_idx]
 
-    async def _extract_products_with_llm(self, html_content: str, url: str, query: str) -> List[Dict[str, Any]]:
+        result = self._filter_and_sort_top(product_jsons, request, end_idx)
+
+        logger.info("Returning {} products from {} crawled",
+                min(len(result), limit), len(product_jsons))
+
+        return result[start_idx:end_idx]
+
+    async def _extract_products_with_llm(self, url: str, query: str, domain: Optional[str] = None, text_content: str = "") -> List[Dict[str, Any]]:
         """
-        Sử dụng LLM để trích xuất thông tin sản phẩm từ HTML.
+        Sử dụng LLM để trích xuất thông tin sản phẩm từ văn bản trang đã
+        làm sạch (xem strip_page_chrome_to_text).
         """
         logger.info("Extracting products from HTML using LLM for URL: {}", url)
-        
+
+        if domain is None:
+            domain = extract_domain(url)
+
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            for tag in soup(['script', 'style', 'header', 'footer', 'nav']):
-                tag.decompose()
-            
-            text_content = soup.get_text(separator=' ', strip=True)
-            
-            text_content = text_content[:10000] 
+            text_content = text_content[:10000]
             
             prompt = f"""
             Dưới đây là nội dung HTML từ một trang web thương mại điện tử về điện thoại. 
@@ -355,90 +1012,162 @@ class ReflectionService:
             Chỉ trả về đúng JSON theo schema, không có nội dung khác. Chỉ trích xuất các sản phẩm điện thoại thực sự, không tạo thông tin giả.
             """
             
-            response = await self.model.generate_content_async(prompt)
+            response = await self.json_model.generate_content_async(prompt)
             
-            json_pattern = r'\[\s*\{.*\}\s*\]'
-            json_matches = re.search(json_pattern, response.text, re.DOTALL)
+            products = _parse_llm_json(response.text)
             
-            if not json_matches:
-                json_pattern = r'\{.*\}'
-                json_matches = re.search(json_pattern, response.text, re.DOTALL)
+            if products is not None:
+                if isinstance(products, dict):
+                    products = [products]
+                    
+                logger.info("Extracted {} products with LLM from URL: {}", len(products), url)
+
+                # Chuẩn hóa là việc CPU thuần (regex giá, validate...) nên
+                # đẩy sang thread để event loop tiếp tục phục vụ crawl khác
+                return await asyncio.to_thread(self._normalize_llm_products, products, url, domain)
+
+            return []
+        except Exception as e:
+            logger.error("Error extracting products with LLM: {}", e)
+            return []
+
+    def _normalize_llm_products(self, products: List[Dict[str, Any]], url: str, domain: str) -> List[Dict[str, Any]]:
+        """
+        Chuẩn hóa danh sách sản phẩm do LLM trả về: bổ sung id ổn định,
+        chuẩn hóa thương hiệu/giá, điền specifications và sources mặc định.
+        """
+        normalized_products = []
+        now_iso = datetime.now().isoformat()
+        url_base = f"https://{domain}"
+        for product in products:
+            if "id" not in product or not product["id"]:
+                product["id"] = generate_product_id(url, product.get("name", ""))
             
-            if json_matches:
-                json_str = json_matches.group(0)
-                products = json.loads(json_str)
-                
+            if "brand" in product and product["brand"]:
+                product["brand"] = normalize_brand_name(product["brand"])
+            
+            for price_field in ("min_price", "max_price", "average_price"):
+                if price_field not in product or product[price_field] is None:
+                    product[price_field] = 0.0
+                elif isinstance(product[price_field], str):
+                    product[price_field] = float(_PRICE_CLEAN_RE.sub('', product[price_field]) or 0)
+            
+            if "specifications" not in product or not product["specifications"]:
+                product["specifications"] = _new_specs_dict()
+            
+            # Đảm bảo sources có URL hợp lệ
+            if "sources" in product and product["sources"]:
+                for source in product["sources"]:
+                    if "url" in source and source["url"]:
+                        source["url"] = build_absolute_url(source["url"], url_base)
+                    
+                    if "price" in source:
+                        if isinstance(source["price"], str):
+                            source["price"] = float(_PRICE_CLEAN_RE.sub('', source["price"]) or 0)
+                        elif source["price"] is None:
+                            source["price"] = 0.0
+                    
+                    if "last_updated" not in source or not source["last_updated"]:
+                        source["last_updated"] = now_iso
+            
+            if "image_url" not in product or not product["image_url"]:
+                product["image_url"] = []
+            elif isinstance(product["image_url"], str):
+                product["image_url"] = [product["image_url"]]
+            
+            if _is_acceptable_product(product):
+                normalized_products.append(product)
+
+        return normalized_products
+
+    async def _extract_products_batch(self, pages: List[tuple], query: str) -> List[List[Dict[str, Any]]]:
+        """
+        Trích xuất sản phẩm từ nhiều trang trong MỘT lời gọi Gemini.
+        pages là danh sách (url, domain, văn bản đã làm sạch); kết quả trả
+        về là danh sách các danh sách sản phẩm, thẳng hàng với thứ tự
+        trang đầu vào.
+        """
+        if len(pages) == 1:
+            url, domain, text_content = pages[0]
+            return [await self._extract_products_with_llm(url, query, domain, text_content)]
+
+        sections = [
+            f"### URL: {url}\n{text_content[:_LLM_BATCH_TEXT_CAP]}"
+            for url, _, text_content in pages
+        ]
+
+        logger.info("Batch-extracting products with LLM from {} URLs", len(pages))
+
+        prompt = f"""
+        Dưới đây là nội dung văn bản từ {len(pages)} trang web thương mại điện tử về điện thoại,
+        mỗi trang bắt đầu bằng dòng "### URL: ...".
+
+        Query tìm kiếm: {query}
+
+        {chr(10).join(sections)}
+
+        Hãy trích xuất thông tin các sản phẩm điện thoại của TỪNG trang và trả về một mảng JSON
+        gồm đúng {len(pages)} phần tử, phần tử thứ i là mảng sản phẩm của trang thứ i (mảng rỗng
+        nếu trang không có sản phẩm). Mỗi sản phẩm theo schema:
+        ```json
+        {{
+            "name": "Tên sản phẩm",
+            "brand": "Thương hiệu",
+            "model": "Model",
+            "min_price": giá_thấp_nhất (số, không có dấu phẩy),
+            "max_price": giá_cao_nhất (số, không có dấu phẩy),
+            "average_price": giá_trung_bình (số, không có dấu phẩy),
+            "image_url": ["url_hình_ảnh"],
+            "specifications": {{}},
+            "sources": [
+            {{
+                "name": "Tên trang web",
+                "url": "URL trang sản phẩm",
+                "price": giá (số, không có dấu phẩy),
+                "price_currency": "VND",
+                "in_stock": true
+            }}
+            ]
+        }}
+        ```
+
+        Chỉ trả về đúng JSON theo schema, không có nội dung khác. Chỉ trích xuất các sản phẩm điện thoại thực sự, không tạo thông tin giả.
+        """
+
+        parsed = None
+        try:
+            response = await self.json_model.generate_content_async(prompt)
+            parsed = _parse_llm_json(response.text)
+        except Exception as e:
+            logger.error("Error batch-extracting products with LLM: {}", e)
+
+        if not isinstance(parsed, list) or len(parsed) != len(pages):
+            # Kết quả không thẳng hàng với đầu vào: quay về mỗi trang một lời gọi
+            logger.warning("Batch extraction misaligned, falling back to per-URL extraction")
+            return list(await asyncio.gather(*(
+                self._extract_products_with_llm(url, query, domain, text_content)
+                for url, domain, text_content in pages
+            )))
+
+        def normalize_all():
+            results = []
+            for (url, domain, _), products in zip(pages, parsed):
                 if isinstance(products, dict):
                     products = [products]
-                    
-                logger.info("Extracted {} products with LLM from URL: {}", len(products), url)
-                
-                normalized_products = []
-                for product in products:
-                    if "id" not in product or not product["id"]:
-                        product["id"] = str(uuid.uuid4())
-                    
-                    if "brand" in product and product["brand"]:
-                        product["brand"] = normalize_brand_name(product["brand"])
-                    
-                    for price_field in ["min_price", "max_price", "average_price"]:
-                        if price_field in product:
-                            if isinstance(product[price_field], str):
-                                product[price_field] = float(re.sub(r'[^\d.]', '', product[price_field]) or 0)
-                            elif product[price_field] is None:
-                                product[price_field] = 0.0
-                    
-                    if "specifications" not in product or not product["specifications"]:
-                        product["specifications"] = {
-                            "cpu": None,
-                            "ram": None,
-                            "storage": None,
-                            "display": None,
-                            "camera": None,
-                            "battery": None,
-                            "os": None,
-                            "connectivity": [],
-                            "color": [],
-                            "dimensions": None,
-                            "weight": None,
-                            "additional_specs": {}
-                        }
-                    
-                    # Đảm bảo sources có URL hợp lệ
-                    if "sources" in product and product["sources"]:
-                        for source in product["sources"]:
-                            if "url" in source and source["url"] and not source["url"].startswith(('http://', 'https://')):
-                                domain = extract_domain(url)
-                                source["url"] = f"https://{domain}{source['url'] if source['url'].startswith('/') else '/' + source['url']}"
-                            
-                            if "price" in source:
-                                if isinstance(source["price"], str):
-                                    source["price"] = float(re.sub(r'[^\d.]', '', source["price"]) or 0)
-                                elif source["price"] is None:
-                                    source["price"] = 0.0
-                            
-                            if "last_updated" not in source or not source["last_updated"]:
-                                source["last_updated"] = datetime.now().isoformat()
-                    
-                    if "image_url" not in product or not product["image_url"]:
-                        product["image_url"] = []
-                    elif isinstance(product["image_url"], str):
-                        product["image_url"] = [product["image_url"]]
-                    
-                    try:
-                        from app.models.product import Product as ProductModel
-                        validated_product = ProductModel(**product)
-                        normalized_products.append(product)
-                    except Exception as e:
-                        logger.error("Product validation error: {}", e)
-                
-                return normalized_products
-                
-            return []
-        except Exception as e:
-            logger.error("Error extracting products with LLM: {}", e)
-            return []
-    
+                elif not isinstance(products, list):
+                    products = []
+                try:
+                    results.append(self._normalize_llm_products(products, url, domain))
+                except Exception as e:
+                    # Một trang lỗi (vd giá LLM trả về không ép float được)
+                    # chỉ mất sản phẩm của trang đó, không hỏng cả lô
+                    logger.error("Error normalizing products from {}: {}", url, e)
+                    results.append([])
+            return results
+
+        # Chuẩn hóa cả lô trong một lần nhảy sang thread thay vì chặn loop
+        return await asyncio.to_thread(normalize_all)
+
     async def crawl_product_detail(self, product_id: str) -> Optional[Dict[str, Any]]:
         """
         Crawl thông tin chi tiết sản phẩm từ web và lưu vào RAG.
@@ -451,8 +1180,8 @@ class ReflectionService:
             logger.warning("No URLs found for product ID: {}", product_id)
             return None
         
-        from app.services.rag_service import RAGService
-        rag_service = RAGService()
+        from app.services.rag_service import get_rag_service
+        rag_service = get_rag_service()
         
         url = search_results[0]
         
@@ -463,18 +1192,22 @@ class ReflectionService:
                 logger.warning("No HTML content from URL: {}", url)
                 return None
             
-            documents = await self._process_html_with_structure_loader(html_content, url)
-            
-            if not documents:
-                logger.warning("No documents extracted from HTML for URL: {}", url)
-                return None
-            
-            product_data = await self._extract_product_detail_from_html(html_content, url)
-            
+            domain = extract_domain(url)
+
+            # Trích xuất sản phẩm trước: nếu thất bại thì khỏi tốn công
+            # chuyển văn bản + chia chunk cho RAG
+            product_data = await self._extract_product_detail_from_html(html_content, url, domain)
+
             if not product_data:
                 logger.warning("Failed to extract product data from HTML for URL: {}", url)
                 return None
-            
+
+            documents = await self._process_html_with_structure_loader(html_content, url, domain)
+
+            if not documents:
+                logger.warning("No documents extracted from HTML for URL: {}", url)
+                return None
+
             for doc in documents:
                 doc.metadata["product_data"] = product_data
             
@@ -487,13 +1220,36 @@ class ReflectionService:
     
     async def _search_urls(self, query: str) -> List[str]:
         """
-        Sử dụng SearXNG để tìm kiếm các URL.
+        Sử dụng SearXNG để tìm kiếm các URL. Kết quả được cache theo truy
+        vấn và các lời gọi trùng nhau đang chạy được gộp lại (single-flight)
+        để N phiên hỏi cùng lúc chỉ tạo một lời gọi SearXNG.
         """
-        logger.info("Searching URLs with SearXNG for: {}", query)
-        
         # Thêm từ khóa tìm kiếm chuyên biệt cho điện thoại
         enhanced_query = f"{query} điện thoại site:thegioididong.com OR site:fptshop.com.vn OR site:cellphones.com.vn OR site:hoanghamobile.com"
-        
+
+        if settings.ENABLE_CACHE:
+            cached = _SEARCH_CACHE.get(enhanced_query)
+            if cached is not None:
+                logger.info("Search cache hit for: {}", query)
+                return list(cached)
+            if enhanced_query in _SEARCH_EMPTY_CACHE:
+                logger.info("Search negative-cache hit for: {}, using fallback URLs", query)
+                return self._get_fallback_urls(query)
+
+        task = self._search_inflight.get(enhanced_query)
+        if task is None:
+            task = asyncio.create_task(self._search_urls_uncached(query, enhanced_query))
+            self._search_inflight[enhanced_query] = task
+            task.add_done_callback(lambda _t: self._search_inflight.pop(enhanced_query, None))
+
+        return list(await task)
+
+    async def _search_urls_uncached(self, query: str, enhanced_query: str) -> List[str]:
+        """
+        Gọi SearXNG thật sự; chỉ được dùng qua _search_urls.
+        """
+        logger.info("Searching URLs with SearXNG for: {}", query)
+
         search_url = f"{settings.SEARXNG_API_URL}/search"
         params = {
             "q": enhanced_query,
@@ -514,86 +1270,74 @@ class ReflectionService:
             
             if not isinstance(data, dict) or "results" not in data:
                 logger.error("Invalid response format from SearXNG: {}", data)
+                if settings.ENABLE_CACHE:
+                    _SEARCH_EMPTY_CACHE[enhanced_query] = True
                 return self._get_fallback_urls(query)
-            
+
             results = data.get("results", [])
             if not results:
                 logger.warning("No results from SearXNG, using fallback URLs")
+                if settings.ENABLE_CACHE:
+                    _SEARCH_EMPTY_CACHE[enhanced_query] = True
                 return self._get_fallback_urls(query)
             
-            urls = []
+            # Lọc domain + khử trùng lặp trong một lượt, dừng sớm khi đủ
+            # MAX_CRAWL_PAGES thay vì lọc hết rồi mới cắt
+            max_pages = settings.MAX_CRAWL_PAGES
+            seen = set()
+            unique_urls = []
             for result in results:
-                if "url" in result:
-                    url = result["url"]
-                    domain = extract_domain(url)
-                    if self._is_valid_ecommerce_domain(domain):
-                        urls.append(url)
-            
-            unique_urls = list(dict.fromkeys(urls))[:settings.MAX_CRAWL_PAGES]
-            
+                url = result.get("url")
+                if not url or url in seen:
+                    continue
+                if self._is_valid_ecommerce_domain(extract_domain(url)):
+                    seen.add(url)
+                    unique_urls.append(url)
+                    if len(unique_urls) >= max_pages:
+                        break
+
+
             # Nếu không tìm thấy URL hợp lệ, sử dụng URL dự phòng
             if not unique_urls:
                 logger.warning("No valid e-commerce URLs found, using fallback URLs")
+                if settings.ENABLE_CACHE:
+                    _SEARCH_EMPTY_CACHE[enhanced_query] = True
                 return self._get_fallback_urls(query)
-            
+
             logger.info("Found {} unique URLs from SearXNG", len(unique_urls))
+            if settings.ENABLE_CACHE:
+                _SEARCH_CACHE[enhanced_query] = unique_urls
             return unique_urls
         except Exception as e:
             logger.error("Error searching URLs with SearXNG: {}", e)
+            if settings.ENABLE_CACHE:
+                _SEARCH_EMPTY_CACHE[enhanced_query] = True
             return self._get_fallback_urls(query)
 
     def _get_fallback_urls(self, query: str) -> List[str]:
         """
         Cung cấp URL dự phòng khi không thể tìm thấy URL từ SearXNG.
         """
-        query_encoded = query.replace(" ", "+")
-        
-        # Check for brands in query
-        brands = {
-            "xiaomi": ["xiaomi", "redmi", "poco"],
-            "samsung": ["samsung", "galaxy"],
-            "apple": ["apple", "iphone"],
-            "oppo": ["oppo"],
-            "vivo": ["vivo"],
-            "realme": ["realme"],
-            "nokia": ["nokia"],
-            "huawei": ["huawei"],
-            "honor": ["honor"]
-        }
-        
+        query_encoded = quote_plus(query)
+
+        # Check for brands in query: hạ chữ thường MỘT lần rồi quét bảng
+        # từ khóa module-level thay vì .lower() lại cho từng keyword
+        q_lower = query.lower()
         detected_brand = None
-        for brand, keywords in brands.items():
-            if any(keyword in query.lower() for keyword in keywords):
+        for brand, keywords in _FALLBACK_BRAND_KEYWORDS.items():
+            if any(keyword in q_lower for keyword in keywords):
                 detected_brand = brand
                 break
-        
-        fallback_urls = [
-            f"https://www.thegioididong.com/tim-kiem?q={query_encoded}",
-            f"https://fptshop.com.vn/tim-kiem/{query_encoded}",
-            f"https://cellphones.com.vn/catalogsearch/result/?q={query_encoded}",
-            f"https://hoanghamobile.com/tim-kiem?kwd={query_encoded}"
-        ]
-        
-        # Thêm URL danh mục nếu phát hiện thương hiệu
+
+        fallback_urls = [tmpl.format(q=query_encoded) for tmpl in _FALLBACK_SEARCH_URL_TMPLS]
+
+        # Chèn URL danh mục thương hiệu lên đầu nếu phát hiện thương hiệu,
+        # không thì nối thêm danh mục chung
         if detected_brand:
-            brand_urls = [
-                f"https://www.thegioididong.com/dtdd-{detected_brand}",
-                f"https://fptshop.com.vn/dien-thoai/{detected_brand}",
-                f"https://cellphones.com.vn/mobile/{detected_brand}.html",
-                f"https://hoanghamobile.com/dien-thoai-di-dong/{detected_brand}"
-            ]
-            fallback_urls = brand_urls + fallback_urls
-        
-        # Thêm URL danh mục chung nếu không có thương hiệu cụ thể
+            fallback_urls[0:0] = _FALLBACK_BRAND_URLS[detected_brand]
         else:
-            category_urls = [
-                "https://www.thegioididong.com/dtdd",
-                "https://fptshop.com.vn/dien-thoai",
-                "https://cellphones.com.vn/mobile.html",
-                "https://hoanghamobile.com/dien-thoai-di-dong"
-            ]
-            fallback_urls.extend(category_urls)
-        
+            fallback_urls.extend(_FALLBACK_CATEGORY_URLS)
+
         logger.info("Using {} fallback URLs", len(fallback_urls))
         return fallback_urls[:settings.MAX_CRAWL_PAGES]
         
@@ -601,68 +1345,116 @@ class ReflectionService:
         """
         Kiểm tra domain có phải là trang thương mại điện tử Việt Nam không.
         """
-        valid_domains = [
-            "thegioididong.com", "fptshop.com.vn", "cellphones.com.vn", 
-            "tiki.vn", "lazada.vn", "shopee.vn", "viettelstore.vn",
-            "hoanghamobile.com", "nguyenkim.com", "sendo.vn", 
-            "dienmayxanh.com", "bachlong.vn", "hangchinhhieu.vn",
-            "vienthongA.vn", "phongvu.vn", "anphatpc.com.vn",
-            "hacom.vn", "didongviet.vn", "hnam.com.vn"
-        ]
-        
-        return any(domain.endswith(valid_domain) for valid_domain in valid_domains)
+        return domain.endswith(_VALID_ECOMMERCE_DOMAINS)
+
+    def _products_from_extracted(self, extracted: Any, url: str, domain: str) -> List[Dict[str, Any]]:
+        """
+        Chuyển dữ liệu crawl4ai đã trích xuất server-side thành product
+        dicts, bỏ qua hoàn toàn bước parse HTML phía Python.
+        """
+        if not extracted or not isinstance(extracted, list):
+            return []
+
+        products = []
+        extracted_at = datetime.now()
+        url_base = f"https://{domain}"
+
+        for item in extracted:
+            try:
+                if not isinstance(item, dict):
+                    continue
+
+                name = clean_text(item.get("name") or "")
+                if not name:
+                    continue
+
+                price = extract_price(item.get("price") or "")
+                image_url = build_absolute_url(item.get("image") or "", url_base)
+                product_url = build_absolute_url(item.get("link") or "", url_base)
+
+                brand_match = _BRAND_RE.search(name)
+                brand = brand_match.group(1) if brand_match else name.split()[0]
+
+                product_dict = {
+                    "id": generate_product_id(product_url or url, name),
+                    "name": name,
+                    "brand": normalize_brand_name(brand),
+                    "model": _strip_brand_prefix(name, brand),
+                    "image_url": [image_url] if image_url else [],
+                    "sources": [
+                        {
+                            "name": self._extract_source_name(url),
+                            "url": product_url or url,
+                            "price": float(price),
+                            "price_currency": "VND",
+                            "last_updated": extracted_at,
+                            "in_stock": True
+                        }
+                    ],
+                    "min_price": float(price),
+                    "max_price": float(price),
+                    "average_price": float(price),
+                    "category": "smartphone"
+                }
+
+                if _is_acceptable_product(product_dict):
+                    products.append(product_dict)
+            except Exception as e:
+                logger.error("Error converting extracted item: {}", e)
+
+        if products:
+            logger.info("Got {} products from crawl4ai extraction for URL: {}", len(products), url)
+        return products
     
     async def _crawl_html(self, url: str) -> Optional[str]:
         """
         Lấy HTML từ URL - sử dụng cả crawl4ai và httpx trực tiếp như fallback.
         """
+        html_content, _ = await self._crawl_page(url)
+        return html_content
+
+    async def _crawl_page(self, url: str, extract_schema: Optional[Dict[str, Any]] = None) -> tuple:
+        """
+        Lấy HTML (và dữ liệu đã trích xuất server-side nếu truyền
+        extract_schema) từ URL. Các lời gọi trùng URL đang chạy được gộp
+        vào một task (single-flight) để hai truy vấn đồng thời không crawl
+        cùng một trang hai lần.
+        """
+        # Key gồm cả việc có schema hay không: caller cần extracted_content
+        # không được dùng chung kết quả của một crawl không schema
+        key = (url, extract_schema is not None)
+        task = self._crawl_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._crawl_page_impl(url, extract_schema))
+            self._crawl_inflight[key] = task
+            task.add_done_callback(lambda _t: self._crawl_inflight.pop(key, None))
+
+        return await task
+
+    async def _crawl_page_impl(self, url: str, extract_schema: Optional[Dict[str, Any]] = None) -> tuple:
+        """
+        Crawl thật sự qua crawl4ai, fallback httpx trực tiếp; chỉ được
+        dùng qua _crawl_page.
+        """
         logger.info("Crawling HTML from URL: {}", url)
         
         # Phương pháp 1: Thử sử dụng crawl4ai trước
         try:
             crawl_url = f"{settings.CRAWL4AI_API_URL}/crawl"
-            
-            # Tạo các user agent phổ biến
-            user_agents = [
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
-                "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.0 Safari/605.1.15",
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:113.0) Gecko/20100101 Firefox/113.0",
-                "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36"
-            ]
-            
-            # Chọn ngẫu nhiên một user agent
-            import random
-            user_agent = random.choice(user_agents)
-            
-            # Headers phổ biến
-            headers = {
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-                "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
-                "Cache-Control": "max-age=0",
-                "Connection": "keep-alive",
-                "Sec-Ch-Ua": '"Chromium";v="125", "Google Chrome";v="125"',
-                "Sec-Ch-Ua-Mobile": "?0",
-                "Sec-Ch-Ua-Platform": '"Windows"',
-                "Sec-Fetch-Dest": "document",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-Site": "none",
-                "Sec-Fetch-User": "?1",
-                "Upgrade-Insecure-Requests": "1"
-            }
-            
+
             payload = {
+                **_CRAWL4AI_BASE_PAYLOAD,
                 "urls": [url],
-                "depth": 0,
-                "respect_robots_txt": False,
-                "user_agent": user_agent,
-                "headers": headers,
-                "extract_html": True,
-                "extract": {},
-                "timeout": 30,
-                "retry": 3
+                "user_agent": random.choice(_USER_AGENTS),
+                "extract": extract_schema or {}
             }
             
-            response = await self.client.post(crawl_url, json=payload, timeout=40)
+            response = await self.client.post(
+                crawl_url,
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"},
+                timeout=40
+            )
             
             if response.status_code == 200:
                 data = response.json()
@@ -672,10 +1464,11 @@ class ReflectionService:
                     
                     if crawled_data and url in crawled_data:
                         html_content = crawled_data[url].get("html", "")
+                        extracted = crawled_data[url].get("extracted_content") if extract_schema else None
                         
-                        if html_content:
+                        if html_content or extracted:
                             logger.info("Successfully got HTML from crawl4ai for URL: {}", url)
-                            return html_content
+                            return html_content, extracted
         
             logger.warning("Failed to get HTML with crawl4ai, trying direct httpx as fallback")
         except Exception as e:
@@ -684,85 +1477,98 @@ class ReflectionService:
         
         # Phương pháp 2: Sử dụng httpx trực tiếp
         try:
-            headers = {
-                "User-Agent": random.choice(user_agents),
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-                "Accept-Language": "vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7",
-                "Cache-Control": "max-age=0",
-                "Referer": "https://www.google.com/",
-                "Sec-Ch-Ua": '"Chromium";v="125", "Google Chrome";v="125"',
-                "Sec-Ch-Ua-Mobile": "?0",
-                "Sec-Fetch-Dest": "document",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-Site": "cross-site",
-                "Upgrade-Insecure-Requests": "1",
-                "Connection": "keep-alive"
-            }
-            
-            async with httpx.AsyncClient(headers=headers, follow_redirects=True, timeout=30.0) as client:
-                response = await client.get(url)
-                
-                if response.status_code == 200:
-                    logger.info("Successfully got HTML with direct httpx for URL: {}", url)
-                    return response.text
-                else:
-                    logger.warning("Failed to get HTML with direct httpx: status code {}", response.status_code)
-                    return None
+            headers = {**_FALLBACK_HEADERS, "User-Agent": random.choice(_USER_AGENTS)}
+
+
+            # Dùng lại client pool chung thay vì mở client mới mỗi lần
+            # fallback, để tái sử dụng kết nối keep-alive tới cùng host
+            response = await self.client.get(url, headers=headers, follow_redirects=True)
+
+            if response.status_code == 200:
+                logger.info("Successfully got HTML with direct httpx for URL: {}", url)
+                return response.text, None
+            else:
+                logger.warning("Failed to get HTML with direct httpx: status code {}", response.status_code)
+                return None, None
         except Exception as e:
             logger.error("Error using direct httpx: {}", e)
-            return None
+            return None, None
     
-    async def _process_html_with_structure_loader(self, html_content: str, url: str) -> List[Document]:
+    async def _process_html_with_structure_loader(self, html_content: str, url: str, domain: Optional[str] = None, split: bool = True) -> List[Document]:
         """
-        Sử dụng BeautifulSoup để xử lý HTML và tạo documents.
+        Chuyển HTML thành văn bản và tạo documents. split=False trả về
+        document nguyên khối, bỏ qua bước chia chunk khi caller chỉ cần
+        kiểm tra nội dung.
         """
-        logger.info("Processing HTML with BeautifulSoup for URL: {}", url)
-        
+        logger.info("Processing HTML for URL: {}", url)
+
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            text = soup.get_text(separator=" ", strip=True)
+            text = strip_html_to_text(html_content)
 
-            document = Document(
-                page_content=text,
-                metadata={
-                    "source": url,
-                    "date": datetime.now().isoformat(),
-                    "domain": extract_domain(url)
-                }
-            )
+            metadata = {
+                "source": url,
+                "date": datetime.now().isoformat(),
+                "domain": domain if domain is not None else extract_domain(url)
+            }
+
+            if not split:
+                return [Document(page_content=text, metadata=metadata)]
+
+            # Chia thẳng trên chuỗi: split_documents chỉ bọc split_text và
+            # vòng copy metadata, với một document thì comprehension đủ
+            texts = [
+                Document(page_content=chunk, metadata={**metadata})
+                for chunk in self.text_splitter.split_text(text)
+            ]
 
-            texts = self.text_splitter.split_documents([document])
-            
             logger.info("Created {} document chunks from HTML", len(texts))
             return texts
     
         except Exception as e:
-            logger.error("Error processing HTML with BeautifulSoup: {}", e)
+            logger.error("Error processing HTML: {}", e)
             return []
     
-    async def _extract_products_from_html(self, html_content: str, url: str) -> List[Dict[str, Any]]:
+    async def _extract_products_from_html(self, html_content: str, url: str, domain: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Trích xuất danh sách sản phẩm từ HTML.
         """
         logger.info("Extracting products from HTML for URL: {}", url)
-        
+
+        cache_key = (url, hash(html_content))
+        if settings.ENABLE_CACHE:
+            cached = _EXTRACT_CACHE.get(cache_key)
+            if cached is not None:
+                logger.info("Using cached extraction for URL: {}", url)
+                return list(cached)
+
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            domain = extract_domain(url)
-            
-            selectors = self._get_selectors_for_domain(domain)
-            
-            product_elements = soup.select(selectors["product_item"])
+            from bs4 import BeautifulSoup
+
+            if domain is None:
+                domain = extract_domain(url)
+
+            parse_target = html_content
+            if len(html_content) > _LARGE_HTML_THRESHOLD:
+                item_selector = self._get_selectors_for_domain(domain)["product_item"]
+                cards_html = await asyncio.to_thread(_collect_product_cards, html_content, item_selector)
+                if cards_html:
+                    parse_target = cards_html
+
+            soup = await asyncio.to_thread(BeautifulSoup, parse_target, BS_PARSER)
+
+            selectors = self._get_compiled_selectors_for_domain(domain)
+
+            product_elements = selectors["product_item"].select(soup)
             
             products = []
+            extracted_at = datetime.now()
+            url_base = f"https://{domain}"
             for element in product_elements:
                 try:
-                    name_elem = element.select_one(selectors["product_name"])
-                    price_elem = element.select_one(selectors["product_price"])
-                    image_elem = element.select_one(selectors["product_image"])
-                    link_elem = element.select_one(selectors["product_link"])
+                    name_elem = selectors["product_name"].select_one(element)
+                    price_elem = selectors["product_price"].select_one(element)
+                    image_elem = selectors["product_image"].select_one(element)
+                    link_elem = selectors["product_link"].select_one(element)
                     
                     if not name_elem:
                         continue
@@ -770,51 +1576,32 @@ class ReflectionService:
                     name = clean_text(name_elem.text)
                     price = extract_price(price_elem.text if price_elem else "0")
                     
-                    image_url = ""
-                    if image_elem and image_elem.has_attr('src'):
-                        image_url = image_elem['src']
-                        if not image_url.startswith(('http://', 'https://')):
-                            image_url = f"https://{domain}{image_url if image_url.startswith('/') else '/' + image_url}"
-                    
-                    product_url = ""
-                    if link_elem and link_elem.has_attr('href'):
-                        product_url = link_elem['href']
-                        if not product_url.startswith(('http://', 'https://')):
-                            product_url = f"https://{domain}{product_url if product_url.startswith('/') else '/' + product_url}"
+                    src = image_elem.get('src') if image_elem else None
+                    image_url = build_absolute_url(src, url_base) if src else ""
+
+                    href = link_elem.get('href') if link_elem else None
+                    product_url = build_absolute_url(href, url_base) if href else ""
                     
-                    brand_match = re.search(r'^(Samsung|Apple|iPhone|Xiaomi|Oppo|Vivo|Nokia|Realme|Huawei|Honor)', name, re.IGNORECASE)
+                    brand_match = _BRAND_RE.search(name)
                     brand = brand_match.group(1) if brand_match else name.split()[0]
                     
-                    product_id = str(uuid.uuid4())
+                    product_id = generate_product_id(product_url or url, name)
                     
                     product_dict = {
                         "id": product_id,
                         "name": name,
                         "brand": normalize_brand_name(brand),
-                        "model": name.replace(brand, '').strip(),
+                        "model": _strip_brand_prefix(name, brand),
                         "description": "",
                         "image_url": [image_url] if image_url else [],
-                        "specifications": {
-                            "cpu": None,
-                            "ram": None,
-                            "storage": None,
-                            "display": None,
-                            "camera": None,
-                            "battery": None,
-                            "os": None,
-                            "connectivity": [],
-                            "color": [],
-                            "dimensions": None,
-                            "weight": None,
-                            "additional_specs": {}
-                        },
+                        "specifications": _new_specs_dict(),
                         "sources": [
                             {
                                 "name": self._extract_source_name(url),
                                 "url": product_url or url,
                                 "price": float(price),
                                 "price_currency": "VND",
-                                "last_updated": datetime.now(),
+                                "last_updated": extracted_at,
                                 "in_stock": True
                             }
                         ],
@@ -824,39 +1611,41 @@ class ReflectionService:
                         "category": "smartphone"
                     }
                     
-                    try:
-                        product = Product(**product_dict)
+                    if _is_acceptable_product(product_dict):
                         products.append(product_dict)
-                    except ValidationError as ve:
-                        logger.error("Validation error for product data: {}", ve)
-                        continue
                     
                 except Exception as e:
                     logger.error("Error extracting product from element: {}", e)
                     continue
             
             logger.info("Extracted {} products from HTML", len(products))
+            if settings.ENABLE_CACHE and products:
+                _EXTRACT_CACHE[cache_key] = products
             return products
         except Exception as e:
             logger.error("Error extracting products from HTML: {}", e)
             return []
         
-    async def _extract_product_detail_from_html(self, html_content: str, url: str) -> Optional[Dict[str, Any]]:
+    async def _extract_product_detail_from_html(self, html_content: str, url: str, domain: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Trích xuất thông tin chi tiết sản phẩm từ HTML.
         """
         logger.info("Extracting product detail from HTML for URL: {}", url)
-        
+
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            domain = extract_domain(url)
-            detail_selectors = self._get_detail_selectors_for_domain(domain)
-            name_elem = soup.select_one(detail_selectors["product_name"])
-            price_elem = soup.select_one(detail_selectors["product_price"])
-            image_elems = soup.select(detail_selectors["product_images"])
-            desc_elem = soup.select_one(detail_selectors["product_description"])
-            specs_elem = soup.select_one(detail_selectors["product_specifications"])
-            brand_elem = soup.select_one(detail_selectors["product_brand"])
+            from bs4 import BeautifulSoup
+
+            soup = await asyncio.to_thread(BeautifulSoup, html_content, BS_PARSER)
+            if domain is None:
+                domain = extract_domain(url)
+            detail_selectors = self._get_compiled_detail_selectors_for_domain(domain)
+            fields = _match_fields_single_pass(soup, detail_selectors, _DETAIL_LIST_FIELDS)
+            name_elem = fields["product_name"]
+            price_elem = fields["product_price"]
+            image_elems = fields["product_images"]
+            desc_elem = fields["product_description"]
+            specs_elem = fields["product_specifications"]
+            brand_elem = fields["product_brand"]
             
             if not name_elem:
                 logger.error("Product name element not found")
@@ -866,23 +1655,18 @@ class ReflectionService:
             price = extract_price(price_elem.text if price_elem else "0")
             description = clean_text(desc_elem.text) if desc_elem else ""
             
-            image_urls = []
-            for img in image_elems:
-                if img.has_attr('src'):
-                    image_url = img['src']
-                    if not image_url.startswith(('http://', 'https://')):
-                        image_url = f"https://{domain}{image_url if image_url.startswith('/') else '/' + image_url}"
-                    image_urls.append(image_url)
-            
+            url_base = f"https://{domain}"
+            image_urls = [
+                build_absolute_url(src, url_base)
+                for img in image_elems if (src := img.get('src'))
+            ]
+
             brand = ""
             if brand_elem:
-                if brand_elem.has_attr('content'):
-                    brand = brand_elem['content']
-                else:
-                    brand = clean_text(brand_elem.text)
+                brand = brand_elem.get('content') or clean_text(brand_elem.text)
             
             if not brand:
-                brand_match = re.search(r'^(Samsung|Apple|iPhone|Xiaomi|Oppo|Vivo|Nokia|Realme|Huawei|Honor)', name, re.IGNORECASE)
+                brand_match = _BRAND_RE.search(name)
                 brand = brand_match.group(1) if brand_match else name.split()[0]
             
             brand = normalize_brand_name(brand)
@@ -892,7 +1676,7 @@ class ReflectionService:
                     for row in specs_elem.select('tr'):
                         cells = row.select('td, th')
                         if len(cells) >= 2:
-                            key = clean_text(cells[0].text).lower()
+                            key = sys.intern(clean_text(cells[0].text).lower())
                             value = clean_text(cells[1].text)
                             specifications[key] = value
 
@@ -901,77 +1685,40 @@ class ReflectionService:
                         text = clean_text(item.text)
                         if ':' in text:
                             key, value = map(str.strip, text.split(':', 1))
-                            specifications[key.lower()] = value
+                            specifications[sys.intern(key.lower())] = value
                 else:
                     key_elems = specs_elem.select('.param-name, .spec-name, .spec-key')
                     value_elems = specs_elem.select('.param-value, .spec-value, .spec-val')
                     
                     if len(key_elems) == len(value_elems):
                         for i in range(len(key_elems)):
-                            key = clean_text(key_elems[i].text).lower()
+                            key = sys.intern(clean_text(key_elems[i].text).lower())
                             value = clean_text(value_elems[i].text)
                             specifications[key] = value
             
-            specs_dict = {
-                "cpu": None,
-                "ram": None,
-                "storage": None,
-                "display": None,
-                "camera": None,
-                "battery": None,
-                "os": None,
-                "connectivity": [],
-                "color": [],
-                "dimensions": None,
-                "weight": None,
-                "additional_specs": {}
-            }
+            specs_dict = _new_specs_dict()
             
             for key, value in specifications.items():
-                if any(cpu_key in key for cpu_key in ['cpu', 'chip', 'vi xử lý']):
-                    specs_dict['cpu'] = value
-                elif any(ram_key in key for ram_key in ['ram', 'bộ nhớ ram']):
-                    specs_dict['ram'] = value
-                elif any(storage_key in key for storage_key in ['rom', 'bộ nhớ trong']):
-                    specs_dict['storage'] = value
-                elif any(display_key in key for display_key in ['màn hình', 'display']):
-                    specs_dict['display'] = value
-                elif any(camera_key in key for camera_key in ['camera']):
-                    specs_dict['camera'] = value
-                elif any(battery_key in key for battery_key in ['pin', 'battery']):
-                    specs_dict['battery'] = value
-                elif any(os_key in key for os_key in ['hệ điều hành', 'os']):
-                    specs_dict['os'] = value
-                elif any(connectivity_key in key for connectivity_key in ['kết nối', 'connectivity']):
-                    if isinstance(value, str):
-                        specs_dict['connectivity'] = [c.strip() for c in value.split(',')]
-                    elif isinstance(value, list):
-                        specs_dict['connectivity'] = value
-                    else:
-                        specs_dict['connectivity'] = [str(value)]
-                elif any(color_key in key for color_key in ['màu', 'color']):
+                field = classify_spec_key(key)
+                if field is None:
+                    specs_dict['additional_specs'][key] = value
+                elif field in _LIST_SPEC_FIELDS:
                     if isinstance(value, str):
-                        specs_dict['color'] = [c.strip() for c in value.split(',')]
+                        specs_dict[field] = [c.strip() for c in value.split(',')]
                     elif isinstance(value, list):
-                        specs_dict['color'] = value
+                        specs_dict[field] = value
                     else:
-                        specs_dict['color'] = [str(value)]
-                elif any(dimensions_key in key for dimensions_key in ['kích thước', 'dimensions']):
-                    specs_dict['dimensions'] = value
-                elif any(weight_key in key for weight_key in ['cân nặng', 'trọng lượng']):
-                    specs_dict['weight'] = value
+                        specs_dict[field] = [str(value)]
                 else:
-                    if 'additional_specs' not in specs_dict:
-                        specs_dict['additional_specs'] = {}
-                    specs_dict['additional_specs'][key] = value
+                    specs_dict[field] = value
             
-            product_id = str(uuid.uuid4())
+            product_id = generate_product_id(url, name)
         
             product_dict = {
                 "id": product_id,
                 "name": name,
                 "brand": brand,
-                "model": name.replace(brand, '').strip(),
+                "model": _strip_brand_prefix(name, brand),
                 "description": description,
                 "image_url": image_urls,
                 "specifications": specs_dict,
@@ -992,7 +1739,7 @@ class ReflectionService:
             }
             
             try:
-                product = Product(**product_dict)
+                _PRODUCT_ADAPTER.validate_python(product_dict)
                 return product_dict
             except ValidationError as ve:
                 logger.error("Validation error for product data: {}", ve)
@@ -1006,153 +1753,184 @@ class ReflectionService:
         """
         Lấy selectors phù hợp với domain.
         """
-        default_selectors = {
-            "product_item": "div.product-item, div.product-card, div.product, .cate-pro-item, li.item",
-            "product_name": "h3.product-name, h2.product-title, div.product-info h3, .cate-pro-name, h3",
-            "product_price": "span.price, div.product-price, p.price, .cate-pro-price, .price",
-            "product_image": "img.product-image, div.product-img img, .cate-pro-img img, img",
-            "product_link": "a.product-link, div.product-img a, h3.product-name a, a.pro-thumb, a"
-        }
-        
-        domain_selectors = {
-            "thegioididong.com": {
-                "product_item": "li.item",
-                "product_name": "h3",
-                "product_price": "strong.price",
-                "product_image": "img.thumb",
-                "product_link": "a"
-            },
-            "fptshop.com.vn": {
-                "product_item": "div.cdt-product",
-                "product_name": "h3",
-                "product_price": "div.progress",
-                "product_image": "img",
-                "product_link": "a"
-            },
-            "cellphones.com.vn": {
-                "product_item": "div.product-item",
-                "product_name": "h3.product-name",
-                "product_price": "p.special-price",
-                "product_image": "img.product-img",
-                "product_link": "a.product-name"
-            }
-        }
-        
-        for d, selectors in domain_selectors.items():
-            if domain.endswith(d):
-                return selectors
-                
-        return default_selectors
-    
+        return _lookup_by_domain(domain, _LIST_SELECTORS_BY_DOMAIN) or _DEFAULT_LIST_SELECTORS
+
+    def _get_compiled_selectors_for_domain(self, domain: str) -> Dict[str, Any]:
+        """
+        Lấy selectors danh sách đã biên dịch sẵn cho domain.
+        """
+        return _lookup_by_domain(domain, _COMPILED_LIST_BY_DOMAIN) or _COMPILED_LIST_DEFAULT
+
     def _get_detail_selectors_for_domain(self, domain: str) -> Dict[str, str]:
         """
         Lấy selectors chi tiết phù hợp với domain.
         """
-        default_selectors = {
-            "product_name": "h1.product-name, h1.product-title, div.product-title h1, h1[itemprop='name']",
-            "product_price": "span.price, div.product-price, p.special-price, span[itemprop='price']",
-            "product_images": "div.product-gallery img, img.product-image, div.carousel img, div.swiper-slide img",
-            "product_description": "div.product-description, div.product-content, div.description-content, div[itemprop='description']",
-            "product_specifications": "table.specifications, div.specifications-content, ul.specifications, div.st-param",
-            "product_brand": "span.brand, div.brand, a.brand, meta[itemprop='brand']"
-        }
-        
-        domain_selectors = {
-            "thegioididong.com": {
-                "product_name": "h1",
-                "product_price": "div.box-price p",
-                "product_images": "div.owl-carousel img",
-                "product_description": "div.article-content",
-                "product_specifications": "div.parameter",
-                "product_brand": "meta[itemprop='brand']"
-            },
-            "fptshop.com.vn": {
-                "product_name": "h1.st-name",
-                "product_price": "div.st-price",
-                "product_images": "div.st-slider img",
-                "product_description": "div.st-specification",
-                "product_specifications": "div.st-param",
-                "product_brand": "h1.st-name"
-            },
-            "cellphones.com.vn": {
-                "product_name": "h1.product-name",
-                "product_price": "p.product-price--current",
-                "product_images": "div.product-image img",
-                "product_description": "div.product-description",
-                "product_specifications": "div.product-technical-content",
-                "product_brand": "div.product-brand"
-            }
-        }
-        
-        for d, selectors in domain_selectors.items():
-            if domain.endswith(d):
-                return selectors
-                
-        return default_selectors
-    
+        return _lookup_by_domain(domain, _DETAIL_SELECTORS_BY_DOMAIN) or _DEFAULT_DETAIL_SELECTORS
+
+    def _get_compiled_detail_selectors_for_domain(self, domain: str) -> Dict[str, Any]:
+        """
+        Lấy selectors chi tiết đã biên dịch sẵn cho domain.
+        """
+        return _lookup_by_domain(domain, _COMPILED_DETAIL_BY_DOMAIN) or _COMPILED_DETAIL_DEFAULT
+
     def _extract_source_name(self, url: str) -> str:
         """
         Trích xuất tên nguồn từ URL.
         """
-        domain = extract_domain(url)
-        
-        domain_mapping = {
-            "thegioididong.com": "Thế Giới Di Động",
-            "fptshop.com.vn": "FPT Shop",
-            "cellphones.com.vn": "CellphoneS",
-            "tiki.vn": "Tiki",
-            "lazada.vn": "Lazada",
-            "shopee.vn": "Shopee",
-            "viettelstore.vn": "Viettel Store",
-            "hoanghamobile.com": "Hoàng Hà Mobile",
-            "nguyenkim.com": "Nguyễn Kim",
-            "sendo.vn": "Sendo",
-            "dienmayxanh.com": "Điện Máy Xanh"
-        }
-        
-        for d, name in domain_mapping.items():
-            if domain.endswith(d):
-                return name
-                
-        return domain.split('.')[0].capitalize()
-    
+        return _source_name_for_domain(extract_domain(url))
+
+    # Dưới ngưỡng này thì vòng lặp Python rẻ hơn chi phí dựng mảng numpy
+    _VECTOR_FILTER_THRESHOLD = 200
+
     def _filter_products(self, products: List[Dict[str, Any]], request: ProductListRequest) -> List[Dict[str, Any]]:
         """
-        Lọc sản phẩm theo yêu cầu.
+        Lọc sản phẩm theo yêu cầu. Với danh sách lớn, điều kiện giá được
+        đánh giá vector hóa bằng numpy thay vì từng sản phẩm một.
         """
-        filtered = []
-        
+        if len(products) >= self._VECTOR_FILTER_THRESHOLD:
+            return self._filter_products_vectorized(products, request)
+
+        return list(self._iter_filtered(products, request))
+
+    def _iter_filtered(self, products: List[Dict[str, Any]], request: ProductListRequest):
+        """
+        Sinh lười các sản phẩm thỏa điều kiện lọc, để consumer (heap,
+        islice) dừng sớm mà không cần dựng danh sách trung gian.
+        """
+        price_min = request.price_min
+        price_max = request.price_max
+        brand_set = frozenset(request.brands) if request.brands else None
+
         for product in products:
-            if request.price_min is not None and product.get("min_price", 0) < request.price_min:
+            price = product.get("min_price", 0)
+            if price_min is not None and price < price_min:
                 continue
-                
-            if request.price_max is not None and product.get("min_price", 0) > request.price_max:
+
+            if price_max is not None and price > price_max:
                 continue
-                
-            if request.brands and product.get("brand") not in request.brands:
+
+            if brand_set is not None and product.get("brand") not in brand_set:
                 continue
-                
-            filtered.append(product)
-        
-        return filtered
+
+            yield product
+
+    def _filter_products_vectorized(self, products: List[Dict[str, Any]], request: ProductListRequest) -> List[Dict[str, Any]]:
+        """
+        Bản vector hóa của _filter_products cho danh sách lớn: dựng mảng
+        giá một lần rồi lọc bằng mask numpy.
+        """
+        mask = np.ones(len(products), dtype=bool)
+
+        if request.price_min is not None or request.price_max is not None:
+            prices = np.fromiter(
+                (p.get("min_price", 0) or 0 for p in products),
+                dtype=np.float64,
+                count=len(products)
+            )
+            if request.price_min is not None:
+                mask &= prices >= request.price_min
+            if request.price_max is not None:
+                mask &= prices <= request.price_max
+
+        if request.brands:
+            allowed = set(request.brands)
+            brand_mask = np.fromiter(
+                (p.get("brand") in allowed for p in products),
+                dtype=bool,
+                count=len(products)
+            )
+            mask &= brand_mask
+
+        return [products[i] for i in np.flatnonzero(mask)]
     
     def _sort_products(self, products: List[Dict[str, Any]], sort_by: str) -> List[Dict[str, Any]]:
         """
         Sắp xếp sản phẩm theo tiêu chí.
         """
+        if sort_by not in ("price_asc", "price_desc"):
+            return products
+
+        if len(products) >= self._VECTOR_FILTER_THRESHOLD:
+            prices = np.fromiter(
+                (p.get("min_price", 0) or 0 for p in products),
+                dtype=np.float64,
+                count=len(products)
+            )
+            order = np.argsort(prices, kind="stable")
+            if sort_by == "price_desc":
+                order = order[::-1]
+            return [products[i] for i in order]
+
         if sort_by == "price_asc":
-            return sorted(products, key=lambda p: p.get("min_price", 0))
-        elif sort_by == "price_desc":
-            return sorted(products, key=lambda p: p.get("min_price", 0), reverse=True)
-        
-        return products
+            return sorted(products, key=_KEY_MIN_PRICE)
+        return sorted(products, key=_KEY_MIN_PRICE, reverse=True)
+
+    def _filter_and_sort_top(self, products: List[Dict[str, Any]], request: ProductListRequest, top_n: int) -> List[Dict[str, Any]]:
+        """
+        Lọc và sắp xếp trong một lượt duyệt, chỉ giữ top_n sản phẩm đầu
+        bằng heap thay vì sort toàn bộ danh sách rồi cắt trang.
+        """
+        if len(products) >= self._VECTOR_FILTER_THRESHOLD:
+            return self._filter_and_sort_top_columnar(products, request, top_n)
+
+        filtered = self._iter_filtered(products, request)
+
+        if request.sort_by == "price_asc":
+            return heapq.nsmallest(top_n, filtered, key=_KEY_MIN_PRICE)
+        elif request.sort_by == "price_desc":
+            return heapq.nlargest(top_n, filtered, key=_KEY_MIN_PRICE)
+
+        return list(itertools.islice(filtered, top_n))
+
+    def _filter_and_sort_top_columnar(self, products: List[Dict[str, Any]], request: ProductListRequest, top_n: int) -> List[Dict[str, Any]]:
+        """
+        Đường đi dạng cột cho batch lớn: tách cột giá/thương hiệu ra mảng
+        numpy một lần, lọc bằng mask rồi argsort trên các chỉ số sống sót;
+        list dict gốc chỉ dùng để dựng lại kết quả cuối.
+        """
+        prices = np.fromiter(
+            (p.get("min_price", 0) or 0 for p in products),
+            dtype=np.float64,
+            count=len(products)
+        )
+
+        mask = np.ones(len(products), dtype=bool)
+        if request.price_min is not None:
+            mask &= prices >= request.price_min
+        if request.price_max is not None:
+            mask &= prices <= request.price_max
+
+        if request.brands:
+            allowed = frozenset(request.brands)
+            mask &= np.fromiter(
+                (p.get("brand") in allowed for p in products),
+                dtype=bool,
+                count=len(products)
+            )
+
+        indices = np.flatnonzero(mask)
+
+        if request.sort_by in ("price_asc", "price_desc"):
+            order = np.argsort(prices[indices], kind="stable")
+            if request.sort_by == "price_desc":
+                order = order[::-1]
+            indices = indices[order]
+
+        return [products[i] for i in indices[:top_n]]
     
     def _format_chat_history(self, history: List[ChatMessage]) -> str:
         """
         Format lịch sử chat thành văn bản dễ đọc.
         """
-        formatted = []
-        for msg in history:
-            role = "Người dùng" if msg.role == "user" else "Trợ lý"
-            formatted.append(f"{role}: {msg.content}")
-        return "\n".join(formatted)
\ No newline at end of file
+        return "\n".join(
+            f"{_ROLE_LABELS.get(role, _ASSISTANT_LABEL)}: {content}"
+            for role, content in map(_MSG_ROLE_CONTENT, history)
+        )
+
+
+@functools.lru_cache(maxsize=1)
+def get_reflection_service() -> "ReflectionService":
+    """
+    Trả về instance ReflectionService dùng chung cho cả tiến trình.
+    """
+    return ReflectionService()
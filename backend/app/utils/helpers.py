@@ -1,20 +1,56 @@
 import re
+import sys
 import uuid
 import json
 import html
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 
+# selectolax (parser C Lexbor) nhanh hơn html.parser 10-20 lần cho việc
+# chuyển HTML thành văn bản; nếu không cài được thì fallback về BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser as _FastHTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser as _FastHTMLParser
+    except ImportError:
+        _FastHTMLParser = None
+
+# Parser cho BeautifulSoup: lxml (libxml2, C) nhanh hơn html.parser 5-10 lần,
+# fallback về html.parser nếu thiếu thư viện
+try:
+    import lxml  # noqa: F401
+    BS_PARSER = 'lxml'
+except ImportError:
+    BS_PARSER = 'html.parser'
+
+# Regex dùng trong các hàm nóng, biên dịch một lần ở mức module để khỏi
+# tra cache re nội bộ mỗi lần gọi
+_WS_RE = re.compile(r'\s+')
+_LEAD_DASH_RE = re.compile(r'^[\s\-]+')
+_NON_DIGIT_RE = re.compile(r'[^0-9]')
+
 def generate_id() -> str:
     """
     Tạo ID ngẫu nhiên.
     """
     return str(uuid.uuid4())
 
+def generate_product_id(url: str, name: str) -> str:
+    """
+    Tạo ID ổn định cho sản phẩm từ URL nguồn và tên: cùng một sản phẩm
+    crawl lại vẫn cho cùng ID (uuid5 băm namespace, không cần entropy hệ
+    thống như uuid4) nên dedup/cache phía sau hoạt động được.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{url}|{name}"))
+
+@lru_cache(maxsize=1024)
 def extract_domain(url: str) -> str:
     """
-    Trích xuất tên miền từ URL.
+    Trích xuất tên miền từ URL. Kết quả được cache vì cùng một URL
+    thường được phân giải nhiều lần trong một lượt crawl.
     """
     parsed = urlparse(url)
     domain = parsed.netloc
@@ -22,6 +58,57 @@ def extract_domain(url: str) -> str:
         domain = domain[4:]
     return domain
 
+def build_absolute_url(url: str, base: str) -> str:
+    """
+    Ghép URL tương đối với base ('https://<domain>') thành URL tuyệt đối;
+    URL đã tuyệt đối thì trả về nguyên vẹn.
+    """
+    if not url or url[:7] == 'http://' or url[:8] == 'https://':
+        return url
+    return base + url if url[0] == '/' else f"{base}/{url}"
+
+def strip_html_to_text(html_content: str) -> str:
+    """
+    Chuyển HTML thành văn bản thuần, ưu tiên selectolax nếu có.
+    """
+    if not html_content:
+        return ""
+
+    if _FastHTMLParser is not None:
+        tree = _FastHTMLParser(html_content)
+        node = tree.body if tree.body is not None else tree.root
+        if node is not None:
+            return node.text(separator=' ', strip=True)
+        return ""
+
+    soup = BeautifulSoup(html_content, BS_PARSER)
+    return soup.get_text(separator=' ', strip=True)
+
+# Các thẻ "khung trang" không chứa nội dung sản phẩm, bỏ trước khi lấy text
+_PAGE_CHROME_TAGS = ('script', 'style', 'header', 'footer', 'nav')
+
+def strip_page_chrome_to_text(html_content: str) -> str:
+    """
+    Chuyển HTML thành văn bản thuần sau khi loại bỏ script/style/header/
+    footer/nav. Dùng selectolax (C) nếu có — nhanh hơn nhiều lần so với
+    decompose + get_text của BeautifulSoup trên trang lớn.
+    """
+    if not html_content:
+        return ""
+
+    if _FastHTMLParser is not None:
+        tree = _FastHTMLParser(html_content)
+        tree.strip_tags(list(_PAGE_CHROME_TAGS))
+        node = tree.body if tree.body is not None else tree.root
+        if node is not None:
+            return node.text(separator=' ', strip=True)
+        return ""
+
+    soup = BeautifulSoup(html_content, BS_PARSER)
+    for tag in soup(list(_PAGE_CHROME_TAGS)):
+        tag.decompose()
+    return soup.get_text(separator=' ', strip=True)
+
 def clean_text(text: str) -> str:
     """
     Làm sạch văn bản.
@@ -29,70 +116,82 @@ def clean_text(text: str) -> str:
     if not text:
         return ""
     
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = _WS_RE.sub(' ', text.strip())
     text = html.unescape(text)
     return text
 
 def extract_price(text: str) -> float:
     """
-    Trích xuất giá từ văn bản.
+    Trích xuất giá từ văn bản: giữ đúng chữ số ASCII 0-9 bằng regex biên
+    dịch sẵn (str.isdigit còn nhận chữ số Unicode như '²' mà float() từ chối).
     """
     if not text:
         return 0.0
-    
-    price_text = re.sub(r'[^\d]', '', text)
+
+    price_text = _NON_DIGIT_RE.sub('', text)
     if price_text:
         return float(price_text)
     return 0.0
 
+# Bảng chuẩn hóa thương hiệu, dựng một lần ở mức module
+_BRAND_MAP = {
+    'ip': 'Apple',
+    'iphone': 'Apple',
+    'apple': 'Apple',
+    'sam': 'Samsung',
+    'samsung': 'Samsung',
+    'ss': 'Samsung',
+    'xiaomi': 'Xiaomi',
+    'mi': 'Xiaomi',
+    'redmi': 'Xiaomi',
+    'poco': 'Xiaomi',
+    'oppo': 'Oppo',
+    'vivo': 'Vivo',
+    'realme': 'Realme',
+    'nokia': 'Nokia',
+    'itel': 'Itel',
+    'vsmart': 'VinSmart',
+    'lg': 'LG',
+    'sony': 'Sony',
+    'huawei': 'Huawei',
+    'honor': 'Honor',
+    'asus': 'Asus',
+    'oneplus': 'OnePlus',
+    'tecno': 'Tecno',
+    'mobell': 'Mobell',
+    'masstel': 'Masstel'
+}
+
+@lru_cache(maxsize=2048)
 def normalize_brand_name(brand: str) -> str:
     """
-    Chuẩn hóa tên thương hiệu.
+    Chuẩn hóa tên thương hiệu: dò exact rồi dò theo từ đầu tiên, hai phép
+    băm thay vì quét startswith qua cả bảng. Kết quả được cache vì tên
+    thương hiệu lặp lại rất nhiều giữa các sản phẩm.
     """
     if not brand:
         return "Unknown"
-    
-    brand_mapping = {
-        'ip': 'Apple',
-        'iphone': 'Apple',
-        'apple': 'Apple',
-        'sam': 'Samsung',
-        'samsung': 'Samsung',
-        'ss': 'Samsung',
-        'xiaomi': 'Xiaomi',
-        'mi': 'Xiaomi',
-        'redmi': 'Xiaomi',
-        'poco': 'Xiaomi',
-        'oppo': 'Oppo',
-        'vivo': 'Vivo',
-        'realme': 'Realme',
-        'nokia': 'Nokia',
-        'itel': 'Itel',
-        'vsmart': 'VinSmart',
-        'lg': 'LG',
-        'sony': 'Sony',
-        'huawei': 'Huawei',
-        'honor': 'Honor',
-        'asus': 'Asus',
-        'oneplus': 'OnePlus',
-        'tecno': 'Tecno',
-        'mobell': 'Mobell',
-        'masstel': 'Masstel'
-    }
-    
+
     brand_lower = brand.lower().strip()
-    for key, value in brand_mapping.items():
-        if key == brand_lower or brand_lower.startswith(key + ' '):
-            return value
-    
-    return brand.strip().title()
+    hit = _BRAND_MAP.get(brand_lower)
+    if hit is not None:
+        return hit
+
+    first_token = brand_lower.split(' ', 1)[0]
+    hit = _BRAND_MAP.get(first_token)
+    if hit is not None:
+        return hit
+
+    # Intern để hàng nghìn sản phẩm cùng thương hiệu chia sẻ một chuỗi,
+    # so sánh bằng con trỏ khi lọc
+    return sys.intern(brand.strip().title())
 
 def extract_product_info_from_html(html_content: str, url: str) -> Dict[str, Any]:
     """
     Trích xuất thông tin sản phẩm từ HTML.
     """
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = BeautifulSoup(html_content, BS_PARSER)
         
         domain = extract_domain(url)
         
@@ -153,7 +252,7 @@ def extract_product_info_from_html(html_content: str, url: str) -> Dict[str, Any
         
         title = clean_text(title_elem.text) if title_elem else ""
         price = extract_price(price_elem.text) if price_elem else 0.0
-        images = [img.get('src', '') for img in image_elems if img.get('src')]
+        images = [src for img in image_elems if (src := img.get('src'))]
         description = clean_text(desc_elem.text) if desc_elem else ""
         
         specs = extract_specifications(specs_elem) if specs_elem else {}
@@ -214,8 +313,11 @@ def extract_model_from_title(title: str, brand: str) -> str:
     if not title:
         return ""
     
-    model = title.replace(brand, '').strip()
-    model = re.sub(r'^[\s\-]+', '', model)
+    if brand and title.startswith(brand):
+        model = title.removeprefix(brand).strip()
+    else:
+        model = title.replace(brand, '', 1).strip()
+    model = _LEAD_DASH_RE.sub('', model)
     
     return model
 
@@ -257,38 +359,59 @@ def extract_specifications(specs_elem) -> Dict[str, Any]:
     
     return specs
 
+# Ánh xạ alias -> trường chuẩn, dựng phẳng một lần ở mức module thay vì
+# tạo lại dict lồng list mỗi lần gọi; thứ tự giữ nguyên độ ưu tiên cũ
+_SPEC_ALIAS_MAP = {
+    alias: spec_key
+    for spec_key, aliases in (
+        ('cpu', ('cpu', 'chip', 'chipset', 'vi xử lý', 'bộ vi xử lý', 'processor')),
+        ('ram', ('ram', 'bộ nhớ ram', 'memory')),
+        ('storage', ('rom', 'storage', 'bộ nhớ trong', 'internal storage')),
+        ('display', ('display', 'screen', 'màn hình')),
+        ('camera', ('camera', 'camera sau', 'rear camera', 'camera trước', 'front camera')),
+        ('battery', ('battery', 'pin', 'dung lượng pin')),
+        ('os', ('os', 'operating system', 'hệ điều hành')),
+        ('connectivity', ('kết nối', 'connectivity', 'connection', 'network')),
+        ('color', ('color', 'màu sắc', 'màu', 'colours')),
+        ('dimensions', ('dimensions', 'kích thước')),
+        ('weight', ('weight', 'cân nặng', 'trọng lượng')),
+    )
+    for alias in aliases
+}
+
+def classify_spec_key(key: str) -> Optional[str]:
+    """
+    Phân loại key thông số về trường chuẩn ('cpu', 'ram'...), None nếu
+    không khớp: dò exact trước, sau đó quét substring theo thứ tự ưu tiên
+    của bảng alias. Dùng chung cho mọi đường trích xuất thông số.
+    """
+    spec_key = _SPEC_ALIAS_MAP.get(key)
+    if spec_key is not None:
+        return spec_key
+    return next(
+        (canon for alias, canon in _SPEC_ALIAS_MAP.items() if alias in key),
+        None
+    )
+
 def update_specs_dict(specs: Dict[str, Any], key: str, value: str) -> None:
     """
     Cập nhật từ điển thông số kỹ thuật với key và value.
     """
     if not key or not value:
         return
-    
-    key_mapping = {
-        'cpu': ['cpu', 'chip', 'chipset', 'vi xử lý', 'bộ vi xử lý', 'processor'],
-        'ram': ['ram', 'bộ nhớ ram', 'memory'],
-        'storage': ['rom', 'storage', 'bộ nhớ trong', 'internal storage'],
-        'display': ['display', 'screen', 'màn hình'],
-        'camera': ['camera', 'camera sau', 'rear camera', 'camera trước', 'front camera'],
-        'battery': ['battery', 'pin', 'dung lượng pin'],
-        'os': ['os', 'operating system', 'hệ điều hành'],
-        'connectivity': ['kết nối', 'connectivity', 'connection', 'network'],
-        'color': ['color', 'màu sắc', 'màu', 'colours'],
-        'dimensions': ['dimensions', 'kích thước'],
-        'weight': ['weight', 'cân nặng', 'trọng lượng']
-    }
-    
-    for spec_key, aliases in key_mapping.items():
-        if any(alias in key for alias in aliases):
-            if spec_key == 'color' and isinstance(value, str):
-                if spec_key not in specs:
-                    specs[spec_key] = []
-                colors = [c.strip() for c in value.split(',')]
-                specs[spec_key].extend(colors)
-            else:
-                specs[spec_key] = value
-            return
-    
+
+    spec_key = classify_spec_key(key)
+
+    if spec_key is not None:
+        if spec_key == 'color' and isinstance(value, str):
+            if spec_key not in specs:
+                specs[spec_key] = []
+            colors = [c.strip() for c in value.split(',')]
+            specs[spec_key].extend(colors)
+        else:
+            specs[spec_key] = value
+        return
+
     if 'additional_specs' not in specs:
         specs['additional_specs'] = {}
     specs['additional_specs'][key] = value
\ No newline at end of file